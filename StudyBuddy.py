@@ -3,24 +3,79 @@ import asyncio
 import json
 import time
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
-import aiohttp
-import PyPDF2
-import io
-from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Any, Tuple
+from collections import defaultdict, deque
 
 import discord
 from discord.ext import commands
 from dotenv import load_dotenv
-import google.generativeai as genai
 
 
-from client import supabase
+from async_db import AsyncDB, LoopStallMonitor
+from config_cache import ConfigCache
+from gemini_gateway import GeminiError, GeminiGateway
+from content_cache import ContentCache
+from near_dup import NearDuplicateIndex
+from text_cleanup import TextNormalizer
+from summarize import CHUNK_TOKEN_BUDGET, ChunkSummarizer, estimate_tokens
+from scheduler import TimerScheduler
+from checkpoint import RestoredContext, SessionCheckpointer
+from status_panel import PRIORITY_QUIZ, PRIORITY_STATUS, OutboundQueue, StatusPanel, ThrottledEdit
+from session_log import SessionLogWriter
+from rollups import StudyRollups
+from db import StudyingStatusUpdater
+from voice_index import VoiceIndex
+from sharding import MemoryStateBackend, SharedStateBackend
+from metrics import LoopProfiler, dump_metrics, metrics, serve_metrics
+from rate_limit import ANALYZE_BASE_COST, QUIZ_COST, SharedTokenBucket, TokenBucketLimiter, acquire, format_wait
+from ingest import AttachmentIngestor
+from pdf_extract import warm_pool
+
+## bump these when a prompt changes so old cached answers stop matching
+ANALYZE_PROMPT_VERSION = 1
+QUIZ_PROMPT_VERSION = 1
+ANALYSIS_FALLBACK = ["StudyBuddy was unable to analyze content. Please try again with a different format."]
+
+## the session embed is edited at most this often while the analysis streams in
+ANALYSIS_EDIT_INTERVAL = 1.0
+
+## how long one quiz message waits for answers before it is graded as it stands
+QUIZ_TIMEOUT = float(os.getenv("QUIZ_TIMEOUT", "180"))
+
+## longest a session can hold its cross-shard lock: 8 cycles of work + breaks, with room to spare
+SESSION_LOCK_TTL = 6 * 60 * 60
+
+class Participant:
+    ## one member of a group session, scores are their own, the session keeps the group average
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.joined_at = datetime.utcnow()
+        self.cycles_completed = 0
+        self.quiz_scores = []
+
+    def to_snapshot(self) -> List[Any]:
+        return [self.user_id, self.joined_at.timestamp(), self.cycles_completed, self.quiz_scores]
+
+    @classmethod
+    def from_snapshot(cls, data: List[Any]) -> "Participant":
+        participant = cls(data[0])
+        participant.joined_at = datetime.utcfromtimestamp(data[1])
+        participant.cycles_completed = data[2]
+        participant.quiz_scores = data[3]
+        return participant
+
 
 class StudySession:
-    def __init__(self, user_id: int, guild_id: int, topic: str, bullet_points: List[str], target_cycles: int):
+    ## a solo session belongs to user_id. a group session (group_channel set) belongs to
+    ## the voice channel: one timer, one analysis and one quiz per cycle for everyone in
+    ## `participants`, user_id is just whoever started it
+    def __init__(self, user_id: int, guild_id: int, topic: str, bullet_points: List[str], target_cycles: int,
+                 group_channel: Optional[int] = None):
         self.user_id = user_id
         self.guild_id = guild_id
+        self.group_channel = group_channel
+        self.participants: Dict[int, Participant] = {}
         self.topic = topic
         self.bullet_points = bullet_points
         self.start_time = datetime.utcnow()
@@ -28,97 +83,540 @@ class StudySession:
         self.target_cycles = target_cycles
         self.quiz_scores = []
         self.is_active = True
-        self.timer_task = None
+        self.timer_task = None  ## only set while a phase transition is running
+        self.context = None
         self.work_time = 25 * 60  # 25 minutes in seconds
         self.break_time = 5 * 60  # 5 minutes in seconds
         self.long_break_time = 15 * 60  # 15 minutes for long break after 4 cycles
         self.in_break = False
+        self.quiz_pool = QuizPool()
+        self.quiz_task = None
+        self.analysis_task = None  ## set while the key points are still streaming in
+        self.analysis_note = None
+        self.panel = None
+        self.pending_note = None
+        self.phase = None  ## next scheduled event and its wall clock deadline, for checkpoints
+        self.phase_deadline = 0.0
+
+    @property
+    def is_group(self) -> bool:
+        return self.group_channel is not None
+
+    @property
+    def session_id(self) -> int:
+        ## key for active_sessions, the scheduler and checkpoints. user and channel ids
+        ## are both snowflakes, so they never collide
+        return self.group_channel or self.user_id
+
+    def to_snapshot(self) -> Dict[str, Any]:
+        return {
+            'user_id': self.user_id,
+            'guild_id': self.guild_id,
+            'channel_id': self.context.channel.id if self.context else None,
+            'topic': self.topic,
+            'points': self.bullet_points,
+            'start': self.start_time.timestamp(),
+            'cycle': self.current_cycle,
+            'target': self.target_cycles,
+            'scores': self.quiz_scores,
+            'in_break': self.in_break,
+            'phase': self.phase,
+            'deadline': self.phase_deadline,
+            'group_channel': self.group_channel,
+            'participants': [participant.to_snapshot() for participant in self.participants.values()],
+        }
+
+    def planned_end(self) -> float:
+        ## wall clock time the session would have ended by, generously: the current phase
+        ## plus every cycle left, each with a long break
+        cycles_left = self.target_cycles - self.current_cycle + 1
+        return self.phase_deadline + cycles_left * (self.work_time + self.long_break_time)
+
+    @classmethod
+    def from_snapshot(cls, data: Dict[str, Any]) -> "StudySession":
+        session = cls(data['user_id'], data['guild_id'], data['topic'], data['points'], data['target'],
+                      group_channel=data.get('group_channel'))
+        for participant in data.get('participants', []):
+            session.participants[participant[0]] = Participant.from_snapshot(participant)
+        session.start_time = datetime.utcfromtimestamp(data['start'])
+        session.current_cycle = data['cycle']
+        session.quiz_scores = data['scores']
+        session.in_break = data['in_break']
+        session.phase = data['phase']
+        session.phase_deadline = data['deadline']
+        return session
+
+
+class QuizPool:
+    ## questions generated ahead of time for a session, de-duplicated on the
+    ## question text so later cycles don't ask the same thing again
+
+    def __init__(self, max_size: int = 12):
+        self.max_size = max_size
+        self.questions = deque()
+        self.seen = set()
+        self.generated = 0  ## how many quiz batches were requested, used as the variant
+
+    def _question_key(self, question_data: Dict[str, Any]) -> str:
+        return " ".join(question_data.get("question", "").lower().split())
+
+    def add(self, quiz_questions: List[Dict[str, Any]]) -> int:
+        added = 0
+        for question_data in quiz_questions:
+            key = self._question_key(question_data)
+            if not key or key in self.seen or len(self.questions) >= self.max_size:
+                continue
+            self.seen.add(key)
+            self.questions.append(question_data)
+            added += 1
+        return added
+
+    def take(self, count: int = 3) -> List[Dict[str, Any]]:
+        return [self.questions.popleft() for _ in range(min(count, len(self.questions)))]
+
+    def asked(self) -> List[str]:
+        return list(self.seen)
+
+    def __len__(self):
+        return len(self.questions)
+
+
+class QuizView(discord.ui.View):
+    ## the whole quiz on one message: a row of A-D buttons per question (discord allows
+    ## 5 rows), clicks are recorded and acknowledged by editing the same message, and
+    ## the quiz is graded once everything is answered or the overall timeout runs out
+
+    def __init__(self, questions: List[Dict[str, Any]], user_id: int, timeout: float = QUIZ_TIMEOUT):
+        super().__init__(timeout=timeout)
+        self.questions = questions[:5]
+        self.user_id = user_id
+        self.answers: Dict[int, str] = {}
+
+        for index in range(len(self.questions)):
+            for option in ("A", "B", "C", "D"):
+                button = discord.ui.Button(label=f"{index + 1}{option}", style=discord.ButtonStyle.secondary,
+                                           row=index, custom_id=f"quiz:{user_id}:{index}:{option}")
+                button.callback = self._answer(index, option)
+                self.add_item(button)
+
+    def answer(self, index: int, option: str) -> bool:
+        ## returns True once every question has an answer
+        if 0 <= index < len(self.questions):
+            self.answers[index] = option
+        for item in self.children:
+            _, _, row, label = item.custom_id.split(":")
+            if int(row) == index:
+                item.style = discord.ButtonStyle.primary if label == option else discord.ButtonStyle.secondary
+        return len(self.answers) == len(self.questions)
+
+    def correct_count(self) -> int:
+        return sum(1 for index, question in enumerate(self.questions) if self.answers.get(index) == question["correct_answer"])
+
+    def score(self) -> float:
+        return self.correct_count() / len(self.questions) * 100 if self.questions else 0
+
+    def render(self, graded: bool = False) -> discord.Embed:
+        embed = discord.Embed(
+            title=f"📝 Quiz - {len(self.questions)} Questions" if not graded else f"📝 Quiz Results - {self.correct_count()}/{len(self.questions)}",
+            description="Answer every question below, the quiz is graded once all are answered." if not graded else None,
+            color=0x3498db if not graded else 0x2ecc71
+        )
+        for index, question in enumerate(self.questions):
+            options_text = "\n".join([f"{key}: {value}" for key, value in question["options"].items()])
+            chosen = self.answers.get(index)
+            if not graded:
+                status = f"\n**Your answer:** {chosen}" if chosen else ""
+            elif chosen == question["correct_answer"]:
+                status = f"\n✅ Correct! ({chosen})"
+            elif chosen:
+                status = f"\n❌ Wrong! You picked {chosen}, the correct answer was {question['correct_answer']}"
+            else:
+                status = f"\n⌛ Not answered, the correct answer was {question['correct_answer']}"
+            ## field names stop at 256 characters
+            embed.add_field(name=f"{index + 1}. {question['question']}"[:256], value=options_text + status, inline=False)
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        ## turned away here and not in the callbacks, so they don't restart the view's timeout
+        if interaction.user.id != self.user_id:
+            await interaction.response.send_message("This quiz belongs to someone else's session!", ephemeral=True)
+            return False
+        return True
+
+    def _answer(self, index: int, option: str):
+        async def callback(interaction: discord.Interaction):
+            if self.answer(index, option):
+                ## graded right here, the interaction response is the only edit needed
+                self.stop()
+                await interaction.response.edit_message(embed=self.render(graded=True), view=None)
+            else:
+                await interaction.response.edit_message(embed=self.render(), view=self)
+        return callback
+
+
+class GroupQuizView(QuizView):
+    ## one quiz message for a whole group session. every participant answers on the same
+    ## buttons, clicks are acknowledged ephemerally so the shared message is only edited
+    ## once, when it's graded. `participants` is the session's live dict, someone joining
+    ## mid-quiz can still answer and someone leaving isn't waited for
+
+    def __init__(self, questions: List[Dict[str, Any]], session_id: int, participants: Dict[int, Participant],
+                 timeout: float = QUIZ_TIMEOUT):
+        super().__init__(questions, session_id, timeout=timeout)
+        self.participants = participants
+        self.group_answers: Dict[int, Dict[int, str]] = {}
+
+    def answer_for(self, user_id: int, index: int, option: str) -> bool:
+        ## returns True once every current participant has answered every question
+        if user_id in self.participants and 0 <= index < len(self.questions):
+            self.group_answers.setdefault(user_id, {})[index] = option
+        return all(len(self.group_answers.get(member, {})) == len(self.questions) for member in self.participants)
+
+    def score_of(self, user_id: int) -> float:
+        answers = self.group_answers.get(user_id, {})
+        correct = sum(1 for index, question in enumerate(self.questions) if answers.get(index) == question["correct_answer"])
+        return correct / len(self.questions) * 100 if self.questions else 0
+
+    def scores(self) -> Dict[int, float]:
+        return {user_id: self.score_of(user_id) for user_id in self.participants}
+
+    def render(self, graded: bool = False) -> discord.Embed:
+        answered = sum(1 for member in self.participants if len(self.group_answers.get(member, {})) == len(self.questions))
+        embed = discord.Embed(
+            title=f"📝 Group Quiz - {len(self.questions)} Questions" if not graded else "📝 Group Quiz Results",
+            description=f"Everyone answers on the buttons below, {answered}/{len(self.participants)} done." if not graded else None,
+            color=0x3498db if not graded else 0x2ecc71
+        )
+        for index, question in enumerate(self.questions):
+            options_text = "\n".join([f"{key}: {value}" for key, value in question["options"].items()])
+            if graded:
+                options_text += f"\n✅ Correct answer: {question['correct_answer']}"
+            embed.add_field(name=f"{index + 1}. {question['question']}"[:256], value=options_text, inline=False)
+        if graded:
+            ranking = sorted(self.scores().items(), key=lambda item: item[1], reverse=True)
+            lines = [f"<@{user_id}>: {score:.0f}%" for user_id, score in ranking]
+            embed.add_field(name="🏅 Scores", value="\n".join(lines)[:1024] or "Nobody answered", inline=False)
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id not in self.participants:
+            await interaction.response.send_message("Join the group session with `!study_join` to take the quiz!", ephemeral=True)
+            return False
+        return True
+
+    def _answer(self, index: int, option: str):
+        async def callback(interaction: discord.Interaction):
+            if self.answer_for(interaction.user.id, index, option):
+                self.stop()
+                await interaction.response.edit_message(embed=self.render(graded=True), view=None)
+            else:
+                done = len(self.group_answers[interaction.user.id])
+                await interaction.response.send_message(f"Got it, {index + 1}{option} ({done}/{len(self.questions)} answered).", ephemeral=True)
+        return callback
+
 
+class StudyCommands(commands.Cog):
+    ## commands live on a cog, discord.py doesn't pick up commands declared on the Bot subclass
 
-class StudyBuddy(commands.Bot):
+    def __init__(self, bot: "StudyBuddy"):
+        self.bot = bot
 
     ## study command
+    ## spend is limited per user and per guild inside start_study_session, see rate_limit.py
     @commands.command(name='study')
-    @commands.command(name='study_stop')
-    @commands.cooldown(1, 300, commands.BucketType.user) 
+    async def study(self, context, cycles: int, *, topic_text: str = None):
+        await self.bot.start_study_session(context, cycles, topic_text=topic_text)
+
+    ## one shared session for everyone in the study voice channel, others hop in with !study_join
+    @commands.command(name='study_group')
+    async def study_group(self, context, cycles: int, *, topic_text: str = None):
+        await self.bot.start_study_session(context, cycles, topic_text=topic_text, group=True)
 
-    def __init__(self):
-        super().__init__(command_prefix="!", intents=intents)
-        self.active_sessions: Dict[int, StudySession] = {}  # key: channel_id
-        self.rate_limits: Dict[int, datetime] = {}
-        self.server_configs: Dict[int, Dict[str, Any]] = {}
+    @commands.command(name='study_join')
+    async def study_join(self, context):
+        await self.bot.join_group_session(context)
+
+    @commands.command(name='study_stop')
+    async def study_stop(self, context):
+        await self.bot.stop_study(context)
+
+    @commands.command(name='setup_study')
+    @commands.has_permissions(manage_guild=True)
+    async def setup_study(self, context, channel: discord.VoiceChannel):
+        await self.bot.setup_study_channel(context, channel)
+
+    @commands.command(name='stats')
+    async def stats(self, context, member: discord.Member = None):
+        await self.bot.show_stats(context, member or context.author)
+
+    @commands.command(name='leaderboard')
+    async def leaderboard(self, context, days: int = 7):
+        await self.bot.show_leaderboard(context, days)
+
+
+class StudyBuddy(commands.AutoShardedBot):
+
+    def __init__(self, shard_ids: Optional[List[int]] = None, shard_count: Optional[int] = None,
+                 state_backend: Optional[SharedStateBackend] = None, supabase_client=None, gemini_model=None):
+        intents = discord.Intents.default()
+        intents.message_content = True
+        intents.voice_states = True # to check only if in vc
+        super().__init__(command_prefix="!", intents=intents, shard_ids=shard_ids, shard_count=shard_count)
+        ## shared with the other shard processes, see sharding.py
+        self.state = state_backend or MemoryStateBackend()
+        ## the coordinator restarts a crashed worker with the same shards, so the lock owner
+        ## is the shard set (not the pid) and the new process can take its locks back
+        self.instance_id = f"shards:{','.join(map(str, shard_ids)) if shard_ids else 'all'}"
+        self._restored = False  ## checkpoints are restored once per process, not on every reconnect
+        self.active_sessions: Dict[int, StudySession] = {}  # key: session_id (user id, or voice channel id for a group)
+        self.group_members: Dict[int, int] = {}  # user id -> session_id of the group session they're in
+        ## gemini budget: a user can burst a couple of big sessions, a guild a few dozen.
+        ## the user's bucket is shared by every shard process, see rate_limit.py
+        self.user_limiter = SharedTokenBucket(self.state, "llm:user", capacity=12, rate=12 / 3600)
+        self.guild_limiter = TokenBucketLimiter(capacity=120, rate=120 / 3600)
+        self.server_configs = ConfigCache(maxsize=5000, ttl=600)
+        ## both clients can be swapped out, bench_load.py runs the bot against fakes
+        ## and neither is created here, see start_services/warm_up
+        self.db = AsyncDB(supabase_client)
+        self.loop_monitor = LoopStallMonitor()
+        self.gemini = GeminiGateway(model=gemini_model)
+        self.content_cache = ContentCache(db=self.db if os.getenv("CONTENT_CACHE_SUPABASE") else None)
+        self.near_dups = NearDuplicateIndex(prompt_version=ANALYZE_PROMPT_VERSION)
+        self.summarizer = ChunkSummarizer(self.gemini, self.content_cache)
+        self.scheduler = TimerScheduler(self.on_timer)
+        self.outbound = OutboundQueue()
+        ## the spill file is read and then deleted, so every shard process needs its own.
+        ## named after the shard set, a restarted worker replays what its predecessor spilled
+        spill_path = os.getenv("STUDYBUDDY_SPILL_PATH", "session_logs.spill.jsonl")
+        if shard_ids:
+            root, ext = os.path.splitext(spill_path)
+            spill_path = f"{root}.shards-{'-'.join(map(str, shard_ids))}{ext}"
+        self.session_log = SessionLogWriter(self.db, spill_path=spill_path)
+        self.rollups = StudyRollups(self.db)
+        self.studying_status = StudyingStatusUpdater(self.db)
+        self.voice_index = VoiceIndex()
+        self.ingestor = AttachmentIngestor()
+        self.checkpointer = SessionCheckpointer(db=self.db if os.getenv("CHECKPOINT_SUPABASE") else None)
+        self.profiler: Optional[LoopProfiler] = None
+        self._metrics_tasks: List[Any] = []
+        self._warmup_task: Optional[asyncio.Task] = None
+        self.register_gauges()
+
+    def register_gauges(self):
+        ## read lazily on every scrape, nothing is sampled in between
+        metrics.gauge("active_sessions", lambda: len(self.active_sessions))
+        metrics.gauge("group_participants", lambda: len(self.group_members))
+        metrics.gauge("loop_lag_seconds", lambda: self.loop_monitor.last_lag)
+        metrics.gauge("loop_lag_max_seconds", lambda: self.loop_monitor.max_lag)
+        metrics.gauge("config_cache_hit_rate", lambda: self.server_configs.stats()['hit_rate'])
+        metrics.gauge("content_cache_hit_rate", lambda: self.content_cache.stats()['hit_rate'])
+        metrics.gauge("near_duplicate_hit_rate", lambda: self.near_dups.stats()['hit_rate'])
+        metrics.gauge("gemini_in_flight", lambda: self.gemini.stats()['in_flight'])
+        metrics.gauge("scheduler_pending", lambda: len(self.scheduler))
+        metrics.gauge("outbound_queue_length", lambda: len(self.outbound._heap))
+        metrics.gauge("session_log_queued", lambda: len(self.session_log._buffer))
+        metrics.gauge("rollup_rows_cached", lambda: self.rollups.stats()['rows_cached'])
+        metrics.gauge("rate_limit_buckets", lambda: len(self.guild_limiter))
+
+    async def start_metrics(self):
+        ## on_ready fires again after every reconnect, only start these once
+        if self._metrics_tasks:
+            return
+        if os.getenv("STUDYBUDDY_PROFILE"):
+            self.profiler = LoopProfiler(threshold=float(os.getenv("STUDYBUDDY_PROFILE_THRESHOLD", "0.1")))
+            self.profiler.start(asyncio.get_running_loop())
+        if os.getenv("METRICS_PORT"):
+            server = await serve_metrics(int(os.getenv("METRICS_PORT")), os.getenv("METRICS_HOST", "127.0.0.1"), self.profiler)
+            self._metrics_tasks.append(server)
+        if os.getenv("METRICS_FILE"):
+            self._metrics_tasks.append(asyncio.create_task(dump_metrics(os.getenv("METRICS_FILE"))))
+
+    async def setup_hook(self):
+        await self.add_cog(StudyCommands(self))
 
     async def on_ready(self):
         print(f'{self.user} has connected to Discord!')
+        await self.start_services([guild.id for guild in self.guilds])
         await self.change_presence(
             status=discord.Status.online,
             activity=discord.Game(name="🍅 !! Study Sessions !!")
         )
 
+    async def start_services(self, guild_ids: List[int]):
+        ## everything on_ready needs besides the gateway, bench_startup.py times this part
+        self.loop_monitor.start()
+        await self.start_metrics()
+        ## the db client is needed right away, create it on a worker thread
+        await self.db.warm()
+        await self.prefetch_server_configs(guild_ids)
+        ## locks left behind by the previous process for these shards, restore_sessions
+        ## takes back the ones whose sessions are still running. on_ready runs again on
+        ## every reconnect, by then the sessions are live in this process (or were ended
+        ## on purpose), so both only happen once
+        if not self._restored:
+            self._restored = True
+            try:
+                await self.state.release_owner(self.instance_id)
+            except Exception as e:
+                print(f"Error clearing stale session locks: {e}")
+            await self.restore_sessions()
+        self.checkpointer.start()
+        await self.session_log.start()
+        if self._warmup_task is None and os.getenv("STUDYBUDDY_WARMUP", "1") != "0":
+            self._warmup_task = asyncio.create_task(self.warm_up())
+
+    async def warm_up(self):
+        ## gemini and the pdf workers load in the background, so the first upload after
+        ## a restart doesn't pay for them. STUDYBUDDY_WARMUP=0 leaves it to first use
+        started = time.perf_counter()
+        results = await asyncio.gather(self.gemini.warm(), warm_pool(), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"Error during warm-up: {result}")
+        metrics.observe("startup.warm_up", time.perf_counter() - started)
+
     async def on_voice_state_update(self, member, before, after):
         ## for handling vc changes of user
 
-        user_id = member.id
+        ## runs for every voice event in every guild, so nothing here awaits:
+        ## anyone who isn't in the index is dropped with a single dict lookup
+        watched = self.voice_index.channel_of(member.id)
+        if watched is None:
+            return
+
+        if after.channel and after.channel.id == watched[1]:
+            ## came back before the grace period ran out
+            self.voice_index.cancel_leave(member.id)
+            return
 
-        if user_id in self.active_sessions:
-            session = self.active_sessions[user_id]
-            study_channel = await self.get_study_channel(member.guild)
+        guild = member.guild
+        self.voice_index.schedule_leave(
+            member.id, lambda: asyncio.create_task(self.cancel_study_session(member.id, guild))
+        )
 
-            if study_channel and (not after.channel or after.channel.id != study_channel.id):
-                await self.cancel_study_session(user_id, member.guild.io)
+    def _default_config(self) -> Dict[str, Any]:
+        return {
+            'study_channel_id': None,
+            'study_channel_name': 'study-vc',
+            'prefix': '!',
+            'max_session_duration': 120
+        }
+
+    def _config_from_row(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'study_channel_id': int(row['study_channel_id']) if row['study_channel_id'] != '0' else None,
+            'study_channel_name': row['study_channel_name'],
+            'prefix': row['prefix'],
+            'max_session_duration': row['max_session_duration']
+        }
+
+    def _config_to_row(self, guild_id: int, config: Dict[str, Any], version: int) -> Dict[str, Any]:
+        return {
+            'guild_id': str(guild_id),
+            'study_channel_id': str(config.get('study_channel_id') or '0'),
+            'study_channel_name': config.get('study_channel_name', 'study-dungeon'),
+            'prefix': config.get('prefix', '!'),
+            'max_session_duration': config.get('max_session_duration', 120),
+            'version': version,
+            'updated_at': datetime.utcnow().isoformat()
+        }
+
+    async def get_server_config(self, guild_id: int) -> Dict[str, Any]:
+        config = self.server_configs.get(guild_id)
+        if config is None:
+            config = await self.load_server_config(guild_id)
+        return config
 
     async def load_server_config(self, guild_id: int):
         try:
-            response = supabase.table('server_configs').select('*').eq('guild_id', str(guild_id)).execute()
+            response = await self.db.execute(self.db.table('server_configs').select('*').eq('guild_id', str(guild_id)))
 
             if response.data:
-                config = response.data[0] ## was found
-                return {
-                    'study_channel_id': int(config['study_channel_id']) if config['study_channel_id'] != '0' else None,
-                    'study_channel_name': config['study_channel_name'],
-                    'prefix': config['prefix'],
-                    'max_session_duration': config['max_session_duration']
-                }
+                row = response.data[0] ## was found
+                config = self._config_from_row(row)
+                self.server_configs.put(guild_id, config, row.get('version') or 0)
+                return config
             else:
-                default_config = {
-                    'study_channel_id': None,
-                    'study_channel_name': 'study-vc',
-                    'prefix': '!',
-                    'max_session_duration': 120
-                }
-                await self.save_server_config(guild_id, default_config)
+                ## new guild, straight insert instead of update -> insert
+                default_config = self._default_config()
+                data = self._config_to_row(guild_id, default_config, 1)
+                data['created_at'] = data['updated_at']
+                await self.db.execute(self.db.table('server_configs').insert(data))
+                self.server_configs.put(guild_id, default_config, 1)
                 return default_config
         except Exception as e:
             print(f"Error loading server config: {e}")
 
-            return {
-                'study_channel_id': None,
-                'study_channel_name': 'study-vc',
-                'prefix': '!',
-                'max_session_duration': 120
-            }
-    
-    async def save_server_config(self, guild_id: int, config: Dict[str, Any]):
-        try:
-            data = {
-                'guild_id': str(guild_id),
-                'study_channel_id': str(config.get('study_channel_id', '0')),
-                'study_channel_name': config.get('study_channel_name', 'study-dungeon'),
-                'prefix': config.get('prefix', '!'),
-                'max_session_duration': config.get('max_session_duration', 120),
-                'updated_at': datetime.utcnow().isoformat()
-            }
-
-            ## update
-            response = supabase.table('server_configs').update(data).eq('guild_id', str(guild_id)).execute()
-
-            if not response.data:
-                ## new
-                data['created_at'] = datetime.utcnow().isoformat()
-                supabase.table('server_configs').insert(data).execute()
+            return self._default_config()
+
+    async def prefetch_server_configs(self, guild_ids: List[int], batch_size: int = 500):
+        ## one `in_` select per batch instead of one select per guild on first !study
+        guild_ids = self.server_configs.missing(guild_ids)
 
+        for i in range(0, len(guild_ids), batch_size):
+            batch = guild_ids[i:i + batch_size]
+            try:
+                response = await self.db.execute(
+                    self.db.table('server_configs').select('*').in_('guild_id', [str(guild_id) for guild_id in batch])
+                )
+                found = set()
+                for row in response.data or []:
+                    guild_id = int(row['guild_id'])
+                    found.add(guild_id)
+                    self.server_configs.put(guild_id, self._config_from_row(row), row.get('version') or 0)
+
+                new_rows = []
+                for guild_id in batch:
+                    if guild_id not in found:
+                        data = self._config_to_row(guild_id, self._default_config(), 1)
+                        data['created_at'] = data['updated_at']
+                        new_rows.append(data)
+                        self.server_configs.put(guild_id, self._default_config(), 1)
+
+                if new_rows:
+                    await self.db.execute(self.db.table('server_configs').insert(new_rows))
+            except Exception as e:
+                print(f"Error prefetching server configs: {e}")
+
+    async def save_server_config(self, guild_id: int, config: Dict[str, Any], attempts: int = 3) -> bool:
+        ## the next version comes from the row, the cache may have dropped the guild. the
+        ## update only applies to the version it was based on, a save from another process
+        ## in between makes it read again
+        try:
+            for _ in range(attempts):
+                response = await self.db.execute(self.db.table('server_configs').select('version').eq('guild_id', str(guild_id)))
+
+                if not response.data:
+                    ## new
+                    version = 1
+                    data = self._config_to_row(guild_id, config, version)
+                    data['created_at'] = data['updated_at']
+                    await self.db.execute(self.db.table('server_configs').insert(data))
+                else:
+                    current = response.data[0].get('version')
+                    version = (current or 0) + 1
+                    query = self.db.table('server_configs').update(self._config_to_row(guild_id, config, version)).eq('guild_id', str(guild_id))
+                    query = query.eq('version', current) if current is not None else query.is_('version', 'null')
+                    if not (await self.db.execute(query)).data:
+                        continue
+
+                ## write through so this process never reads its own stale copy
+                self.server_configs.put(guild_id, dict(config), version)
+                return True
+            print(f"Error saving server config: guild {guild_id} kept changing underneath")
         except Exception as e:
             print(f"Error saving server config: {e}")
+        self.server_configs.invalidate(guild_id)
+        return False
+
+    async def setup_study_channel(self, context, channel: discord.VoiceChannel):
+        config = dict(await self.get_server_config(context.guild.id))
+        config['study_channel_id'] = channel.id
+        config['study_channel_name'] = channel.name
+        if await self.save_server_config(context.guild.id, config):
+            await context.send(f"✅ Study sessions will use {channel.mention} from now on!")
+        else:
+            await context.send("❌ Couldn't save the study channel right now, try again in a bit.")
 
     
 
@@ -135,10 +633,7 @@ class StudyBuddy(commands.Bot):
 
         ## check first
 
-        if guild_id not in self.server_configs:
-            self.server_configs[guild_id] = await self.load_server_config(guild_id)
-
-        config = self.server_configs[guild_id]
+        config = await self.get_server_config(guild_id)
 
         if config['study_channel_id']:
             channel = guild.get_channel(config['study_channel_id'])
@@ -148,23 +643,18 @@ class StudyBuddy(commands.Bot):
         channel = discord.utils.get(guild.voice_channels, name=config['study_channel_name'])
         return channel
 
-    async def extract_text_from_file(self, attachment) -> str:
-        ## extract text 
+    async def analyze_content_with_gemini(self, content: str, guild_id: Optional[int] = None,
+                                          on_points: Optional[Callable[[List[str]], None]] = None,
+                                          cache: bool = True) -> Tuple[List[str], bool]:
+        ## returns (points, complete). with on_points the response is streamed and on_points
+        ## gets the list so far every time a new point is complete. cache=False for content
+        ## that is known to be incomplete, the points are used but never stored
+        cached = await self.content_cache.get('analyze', content, ANALYZE_PROMPT_VERSION)
+        if cached is not None:
+            if on_points:
+                on_points(cached)
+            return cached, True
 
-        text = ""
-
-        if attachment.filename.endswith('.txt') or attachment.filename.endswith('.md'):
-            content = await attachment.read()
-            text = content.decode('utf-8')
-        elif attachment.filename.endswith('.pdf'):
-            content = await attachment.read()
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(content))
-            for page in pdf_reader.pages:
-                text += page.extract_text()
-
-        return text
-
-    async def analyze_content_with_gemini(self, content: str) -> List[str]:
         prompt = f"""
             You are an expert academic tutor and summarization assistant. Your primary goal is to help a student efficiently prepare for a study session or an exam by extracting the most critical information from their learning material.
 
@@ -186,17 +676,99 @@ class StudyBuddy(commands.Bot):
             - Each bullet point must begin with a hyphen and a space (`- `).
             """
         try:
-            response = model.generate_content(prompt)
-            ## isolate
-            bullet_points = [line.strip().lstrip('- ') for line in response.text.split('\n') if line.strip().startswith('-')]
-            return bullet_points
+            with metrics.span("gemini.analyze"):
+                if on_points is None:
+                    response_text = await self.gemini.generate(prompt, guild_id=guild_id)
+                    ## isolate
+                    bullet_points = [line.strip().lstrip('- ') for line in response_text.split('\n') if line.strip().startswith('-')]
+                    complete = True
+                else:
+                    bullet_points, complete = await self.stream_points(prompt, guild_id, on_points)
+            complete = complete and bool(bullet_points)
+            if complete and cache:
+                await self.content_cache.put('analyze', content, ANALYZE_PROMPT_VERSION, bullet_points)
+            return bullet_points, complete
         except Exception as e:
             print(f"Error with Gemini API: {e}")
-            return ["StudyBuddy was unable to analyze content. Please try again with a different format."]
-
-    async def generate_quiz_with_gemini(self, bullet_points: List[str]) -> List[Dict[str, Any]]:
+            return list(ANALYSIS_FALLBACK), False
+
+    async def stream_points(self, prompt: str, guild_id: Optional[int],
+                            on_points: Callable[[List[str]], None]) -> Tuple[List[str], bool]:
+        ## returns (points, complete). if the stream breaks off after some points they
+        ## are kept for this session but not cached
+        points = []
+        buffer = ""
+        try:
+            async for text in self.gemini.stream(prompt, guild_id=guild_id):
+                buffer += text
+                *lines, buffer = buffer.split('\n')
+                new_points = [line.strip().lstrip('- ') for line in lines if line.strip().startswith('-')]
+                if new_points:
+                    points.extend(new_points)
+                    on_points(list(points))
+        except GeminiError as e:
+            if not points:
+                raise
+            print(f"Gemini stream ended early: {e}")
+            return points, False
+
+        if buffer.strip().startswith('-'):
+            points.append(buffer.strip().lstrip('- '))
+            on_points(list(points))
+        return points, True
+
+    async def analyze_study_material(self, documents: List[str], guild_id: Optional[int] = None,
+                                     on_points: Optional[Callable[[List[str]], None]] = None) -> Tuple[List[str], bool]:
+        ## returns (points, complete). incomplete points are good enough for this session
+        ## but are kept out of both caches, the next upload of the material gets a retry.
+        ## a classmate's copy of the same slides (other filename, other footer) reuses
+        ## their points, which also makes the quiz cache hit for this session
+        signature = None
+        if guild_id is not None:
+            signature = await self.near_dups.signature("\n\n".join(documents))
+            bullet_points = await self.near_dups.find(guild_id, signature)
+            if bullet_points:
+                if on_points:
+                    on_points(bullet_points)
+                return bullet_points, True
+
+        ## big uploads are summarized chunk by chunk first, then reduced to the final points
+        condensed = await self.summarizer.condense(documents, guild_id=guild_id)
+        if condensed.partial:
+            print(f"Study material only partly condensed: {condensed.describe()}")
+            metrics.inc("summarize_chunks_failed_total", condensed.chunks_failed)
+        if condensed.failed:
+            ## analyzing an empty source text would only make points up
+            return list(ANALYSIS_FALLBACK), False
+        bullet_points, complete = await self.analyze_content_with_gemini(condensed.text, guild_id=guild_id, on_points=on_points,
+                                                                         cache=not condensed.partial)
+        ## a stream that broke off after a few points is as incomplete as a failed chunk,
+        ## the near-duplicate index would otherwise hand those few points out for good
+        complete = complete and not condensed.partial
+        if guild_id is not None and complete:
+            await self.near_dups.add(guild_id, signature, bullet_points)
+        return bullet_points, complete
+
+    async def generate_quiz_with_gemini(self, bullet_points: List[str], guild_id: Optional[int] = None,
+                                        variant: int = 0, exclude: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         points_text = "\n".join([f"- {point}" for point in bullet_points])
 
+        ## later cycles ask for a different quiz on the same points, so the variant is part of the key
+        cache_text = points_text if not variant else f"{points_text}\n#variant:{variant}"
+        cached = await self.content_cache.get('quiz', cache_text, QUIZ_PROMPT_VERSION)
+        if cached is not None:
+            return cached
+
+        exclude_text = ""
+        if exclude:
+            asked_text = "\n".join([f"- {question}" for question in exclude])
+            exclude_text = f"""
+        **Already Asked (do not repeat these questions):**
+        ---
+        {asked_text}
+        ---
+        """
+
         prompt = f"""
         You are an AI Quiz Designer. Your task is to create a short, effective quiz to help a student reinforce their learning after a study session.
 
@@ -211,7 +783,7 @@ class StudyBuddy(commands.Bot):
         ---
         {points_text}
         ---
-
+        {exclude_text}
         **Instructions for Output Format:**
         Your entire response MUST be a single, valid JSON array. Do not include any text, explanations, or markdown formatting outside of the JSON structure.
 
@@ -233,12 +805,14 @@ class StudyBuddy(commands.Bot):
 
 
         try:
-            response = model.generate_content(prompt)
-            json_start = response.text.find('[')
-            json_end = response.text.rfind(']') + 1
-            json_text = response.text[json_start:json_end]
+            with metrics.span("gemini.quiz"):
+                response_text = await self.gemini.generate(prompt, guild_id=guild_id)
+            json_start = response_text.find('[')
+            json_end = response_text.rfind(']') + 1
+            json_text = response_text[json_start:json_end]
 
             quiz_data = json.loads(json_text)
+            await self.content_cache.put('quiz', cache_text, QUIZ_PROMPT_VERSION, quiz_data)
             return quiz_data
         except Exception as e:
             print(f"Quiz generation error: {e}")
@@ -249,48 +823,164 @@ class StudyBuddy(commands.Bot):
                 "correct_answer": "A"
             }]
         
-    async def start_study_session(self, context, cycles: int, *, topic_text: str = None):
+    async def clean_documents(self, documents: List[str]) -> List[str]:
+        ## headers/footers, page numbers, line wraps and repeated paragraphs never reach a prompt
+        normalizer = TextNormalizer()
+        with metrics.span("extract.normalize"):
+            cleaned = await asyncio.to_thread(normalizer.normalize_documents, documents)
+        metrics.inc("prompt_tokens_in_total", normalizer.tokens_in)
+        metrics.inc("prompt_tokens_saved_total", normalizer.tokens_saved)
+        return cleaned
+
+    def llm_cost(self, documents: List[str], cycles: int) -> float:
+        ## one unit per summarization chunk the material will need, plus a quiz per cycle
+        tokens = sum(estimate_tokens(document) for document in documents)
+        chunks = -(-tokens // CHUNK_TOKEN_BUDGET)
+        return ANALYZE_BASE_COST + max(0, chunks - 1) + QUIZ_COST * cycles
+
+    async def check_llm_budget(self, context, cost: float, charge: bool = True) -> bool:
+        ## more than a full bucket would never go through, no point in telling them to wait
+        if cost > min(self.user_limiter.capacity, self.guild_limiter.capacity):
+            metrics.inc("llm_too_large_total")
+            await context.send("📚 That material is too large for one session! Split it into smaller parts or use fewer cycles.")
+            return False
+
+        if charge:
+            wait = await acquire([(self.guild_limiter, context.guild.id)], cost, shared=(self.user_limiter, context.author.id))
+        else:
+            wait = max(self.guild_limiter.wait_time(context.guild.id, cost), await self.user_limiter.wait_time(context.author.id, cost))
+        if not wait:
+            return True
+
+        metrics.inc("llm_rate_limited_total")
+        if self.guild_limiter.wait_time(context.guild.id, cost) >= await self.user_limiter.wait_time(context.author.id, cost):
+            who = "This server has"
+        else:
+            who = "You've"
+        await context.send(f"⏳ {who} used up the study budget for now, try again in {format_wait(wait)}. Smaller material costs less!")
+        return False
+
+    async def start_study_session(self, context, cycles: int, *, topic_text: str = None, group: bool = False):
     
         user_id = context.author.id
         guild_id = context.guild.id
         study_channel = None
-        content = topic_text or ""
+        documents = [topic_text] if topic_text else []
 
         ## preliminary checks
         if cycles < 1 or cycles > 8:
             await context.send("❌ Number of cycles must be between 1 and 8!")
             return
 
-        if user_id in self.active_sessions:
+        if self.session_of(user_id):
             await context.send("You already have an active study session! Use `!study stop` to end it.")
             return
 
+        if group and not context.author.voice:
+            await context.send("⚠️ Join a voice channel first, the group session moves everyone into the study channel!")
+            return
+
+        ## cheapest possible session first, so an exhausted user is turned away before any download
+        if not await self.check_llm_budget(context, ANALYZE_BASE_COST + QUIZ_COST * cycles, charge=False):
+            return
+
         study_channel = await self.get_study_channel(context.guild)
         if not study_channel:
-            guild_config = self.server_configs.get(context.guild.id, {})
+            guild_config = self.server_configs.get(context.guild.id) or {}
             channel_name = guild_config.get('study_channel_name', 'study-dungeon')
             await context.send(f"❌ Study voice channel not configured! Use `!setup_study <channel>` or create a channel named '{channel_name}'.")
             return
 
+        if group and study_channel.id in self.active_sessions:
+            await context.send(f"👥 A group session is already running in {study_channel.name}, hop in with `!study_join`!")
+            return
+
         if context.message.attachments:
             await context.send ("📥 Processing your attachment...")
-            for attachment in context.message.attachments:
-                file_text = await self.extract_text_from_file(attachment)
-                content += "\n\n" + file_text
-
-        if not content.strip():
+            ## downloaded side by side, each document comes out here as soon as it (and
+            ## everything before it) is extracted
+            async for filename, result in self.ingestor.ingest(context.message.attachments):
+                if result.partial:
+                    await context.send(f"⚠️ `{filename}` was {result.describe()}.")
+                if result.text.strip():
+                    documents.append(result.text)
+
+        documents = await self.clean_documents(documents)
+        if not documents:
             await context.send("❌ Please provide study material either as text or file attachments!")
             return
         
 
-        ## analyze content 
-        await context.send("🧠 Analyzing your study material")
-        bullet_points = await self.analyze_content_with_ai(content)
+        if not await self.check_llm_budget(context, self.llm_cost(documents, cycles)):
+            return
+
+        ## the user could be in a guild on another shard process, the lock is shared
+        if not await self.state.acquire(f"session:{user_id}", self.instance_id, SESSION_LOCK_TTL):
+            await context.send("You already have an active study session in another server! Use `!study_stop` there first.")
+            return
+
+        if group and study_channel.id in self.active_sessions:
+            ## someone else started one in the channel while the material was processed
+            await self.state.release(f"session:{user_id}", self.instance_id)
+            await context.send(f"👥 A group session was just started in {study_channel.name}, hop in with `!study_join`!")
+            return
 
-        ## create session
-        session = StudySession(user_id, guild_id, topic_text or "Study Session", bullet_points, cycles)
-        self.active_sessions[user_id] = session
-       
+        ## the session embed goes out right away and fills in while the analysis streams,
+        ## the timer starts as soon as the first points are there
+        session = StudySession(user_id, guild_id, topic_text or "Study Session", [], cycles,
+                               group_channel=study_channel.id if group else None)
+        self.active_sessions[session.session_id] = session
+        if group:
+            self.add_participant(session, user_id)
+        else:
+            self.studying_status.set(user_id, True)
+
+        started = asyncio.get_running_loop().time()
+        message = await context.send(embed=self.session_embed(session, analyzing=True))
+        editor = ThrottledEdit(message, self.outbound, lambda: self.session_embed(session, analyzing=session.analysis_task is not None),
+                               interval=ANALYSIS_EDIT_INTERVAL)
+        first_points = asyncio.get_running_loop().create_future()
+
+        def on_points(points: List[str]):
+            session.bullet_points = points
+            editor.touch()
+            if not first_points.done():
+                metrics.observe("analysis.first_points", asyncio.get_running_loop().time() - started)
+                first_points.set_result(None)
+
+        session.analysis_task = asyncio.create_task(self.finish_analysis(session, documents, editor, on_points))
+        await asyncio.wait([first_points, session.analysis_task], return_when=asyncio.FIRST_COMPLETED)
+        if not session.is_active:
+            return
+
+        if context.author.voice:
+            await context.author.move_to(study_channel)
+            self.voice_index.watch(user_id, guild_id, study_channel.id)
+        else:
+            await context.send("⚠️ Join the study voice channel to begin!")
+            if session.is_group:
+                ## an empty group session would hold the channel, leaving ends it
+                await self.leave_group_session(session, user_id)
+            return        
+
+        ## !! start timer !! 
+        await self.run_pomodoro_cycle(context, session)
+
+
+    async def finish_analysis(self, session: StudySession, documents: List[str], editor: ThrottledEdit,
+                              on_points: Callable[[List[str]], None]):
+        try:
+            session.bullet_points, complete = await self.analyze_study_material(documents, guild_id=session.guild_id, on_points=on_points)
+        finally:
+            session.analysis_task = None
+        if not complete and session.bullet_points != ANALYSIS_FALLBACK:
+            session.analysis_note = "⚠️ *part of your material couldn't be analyzed, these points may not cover all of it*"
+        editor.flush()
+        if session.is_active and session.context:
+            self.checkpointer.mark_dirty(session.session_id, session.to_snapshot())
+
+    def session_embed(self, session: StudySession, analyzing: bool = False) -> discord.Embed:
+        cycles = session.target_cycles
         total_work_time = cycles * 25
         total_break_time = max(0, cycles - 1) * 5
 
@@ -302,13 +992,20 @@ class StudyBuddy(commands.Bot):
         total_estimated = total_work_time + total_break_time
 
         embed = discord.Embed(
-            title="📚 Study Session Started!",
+            title="📚 Study Session Started!" if not session.is_group else "👥 Group Study Session Started!",
             description=f"**Topic:** {session.topic}",
             color=0x00ff00
         )
+        if session.is_group:
+            embed.description += "\nAnyone can join (or leave) at any point with `!study_join` / `!study_stop`."
 
-        bullet_text = "\n".join([f"• {point}" for point in bullet_points])
-        embed.add_field(name="Key Study Points", value=bullet_text, inline=False)
+        bullet_text = "\n".join([f"• {point}" for point in session.bullet_points])
+        if analyzing:
+            bullet_text = f"{bullet_text}\n🧠 *analyzing your study material...*".strip()
+        elif session.analysis_note:
+            bullet_text = f"{bullet_text}\n{session.analysis_note}"
+        ## field values stop at 1024 characters
+        embed.add_field(name="Key Study Points", value=bullet_text[:1024], inline=False)
 
 
         progress_bar = "🔴" + "⚪" * (cycles - 1)
@@ -319,138 +1016,296 @@ class StudyBuddy(commands.Bot):
         )
 
         embed.add_field(name="⏱️ Current", value="Starting Cycle 1/{}...".format(cycles), inline=False)
-
-        await context.send(embed=embed)
-
-        if context.author.voice:
-            await context.author.move_to(study_channel)
-        else:
-            await context.send("⚠️ Join the study voice channel to begin!")
-            return        
-
-        ## !! start timer !! 
-        session.timer_task = asyncio.create_task(self.run_pomodoro_cycle(context, session))
-
+        return embed
 
     async def run_pomodoro_cycle(self, context, session: StudySession):
-        try:
-            while session.is_active and session.current_cycle < session.target_cycles:
-                session.in_break = False
-                session.current_cycle += 1
-
-                await self.send_progress_update(context, session, "work_start")
-
-                await asyncio.sleep(session.work_time)
+        ## no task sleeps through the cycle anymore, each phase schedules the next
+        ## one on self.scheduler and on_timer picks it up when it's due
+        session.context = context
+        await self.start_work_phase(session)
+
+    async def start_work_phase(self, session: StudySession):
+        session.in_break = False
+        session.current_cycle += 1
+
+        await self.send_progress_update(session.context, session, "work_start", note=session.pending_note)
+        session.pending_note = None
+
+        ## build the next quiz while the user works so it's ready when the timer ends
+        self.start_quiz_prefetch(session)
+
+        self.schedule_phase(session, session.work_time, "work_end")
+
+    def schedule_phase(self, session: StudySession, delay: float, phase: str):
+        session.phase = phase
+        session.phase_deadline = time.time() + delay
+        self.scheduler.schedule(session.session_id, delay, phase)
+        ## batched, the flusher writes it with everything else that changed
+        self.checkpointer.mark_dirty(session.session_id, session.to_snapshot())
+
+    async def restore_sessions(self):
+        ## re-arm sessions that were running before a restart, with whatever time they had left
+        for data in await self.checkpointer.load():
+            session = StudySession.from_snapshot(data)
+            if session.session_id in self.active_sessions:
+                continue
+
+            guild = self.get_guild(data['guild_id'])
+            if guild is None:
+                ## belongs to a shard running in another process
+                continue
+            channel = guild.get_channel(data['channel_id']) if guild and data.get('channel_id') else None
+            members = [member for member in map(guild.get_member, self.session_members(session)) if member]
+            ## after a long outage the session would be long over, don't fire its quiz now
+            if not channel or not members or not data.get('phase') or time.time() > session.planned_end():
+                self.checkpointer.remove(session.session_id)
+                continue
+
+            restored = []
+            for member in members:
+                if await self.state.acquire(f"session:{member.id}", self.instance_id, SESSION_LOCK_TTL):
+                    restored.append(member)
+            if not restored:
+                continue
+
+            if session.is_group:
+                ## whoever started a session somewhere else meanwhile stays out of this one
+                for user_id in set(session.participants) - {member.id for member in restored}:
+                    del session.participants[user_id]
+                for member in restored:
+                    self.group_members[member.id] = session.session_id
+            session.context = RestoredContext(channel, guild.get_member(session.user_id) or restored[0])
+            self.active_sessions[session.session_id] = session
+
+            study_channel = await self.get_study_channel(guild)
+            if study_channel:
+                for member in restored:
+                    self.voice_index.watch(member.id, guild.id, study_channel.id)
+
+            remaining = max(0.0, session.phase_deadline - time.time())
+            self.schedule_phase(session, remaining, session.phase)
+
+            mentions = " ".join(member.mention for member in restored)
+            try:
+                await channel.send(f"♻️ {mentions} StudyBuddy restarted, your session was restored at Cycle {session.current_cycle}/{session.target_cycles} ({remaining / 60:.0f} min left in this phase).")
+            except Exception as e:
+                print(f"Error announcing restored session: {e}")
+
+    async def close(self):
+        self.scheduler.stop()
+        if self._warmup_task:
+            self._warmup_task.cancel()
+        for task in self._metrics_tasks:
+            ## the http server closes, the file dump task is a plain task
+            if isinstance(task, asyncio.Task):
+                task.cancel()
+            else:
+                task.close()
+        if self.profiler:
+            self.profiler.stop()
+        self.outbound.stop()
+        await self.checkpointer.close()
+        await self.session_log.close()
+        await self.rollups.close()
+        await self.studying_status.close()
+        await self.ingestor.close()
+        await super().close()
+
+    async def on_timer(self, session_id: int, phase: str):
+        session = self.active_sessions.get(session_id)
+        if not session or not session.is_active:
+            return
 
-                if not session.is_active:
-                    break
+        ## the running transition (quiz etc.) is what cancel_study_session has to stop
+        session.timer_task = asyncio.current_task()
+        try:
+            if phase == "work_end":
+                await self.end_work_phase(session)
+            elif phase == "break_end":
+                await self.end_break_phase(session)
+        finally:
+            session.timer_task = None
+
+    async def end_work_phase(self, session: StudySession):
+        context = session.context
+
+        if session.is_group:
+            ## members who left the channel are already out of the session (voice index)
+            mentions = " ".join(f"<@{user_id}>" for user_id in session.participants)
+            intro = f"⏰ {mentions} Cycle {session.current_cycle}/{session.target_cycles} work session complete! Time for a quick group quiz!"
+        else:
+            study_channel = await self.get_study_channel(context.guild)
+            in_channel = study_channel and context.author.voice and context.author.voice.channel == study_channel
+            ## a reconnect in progress still counts as present, the grace period decides.
+            ## anyone else is gone for good, end the session instead of leaving it without a timer
+            if not in_channel and not self.voice_index.is_leaving(context.author.id):
+                await self.cancel_study_session(context.author.id, context.guild)
+                return
+            intro = f"⏰ {context.author.mention} Cycle {session.current_cycle}/{session.target_cycles} work session complete! Time for a quick quiz!"
+
+        quiz_score = await self.run_quiz(context, session, intro=intro)
+        if not session.is_active:
+            return
+        session.quiz_scores.append(quiz_score)
+        for participant in session.participants.values():
+            participant.cycles_completed += 1
 
-                study_channel = await self.get_study_channel(context.guild)
-                if study_channel and context.author.voice and context.author.voice.channel == study_channel:
-                    await context.send(f"⏰ {context.author.mention} Cycle {session.current_cycle}/{session.target_cycles} work session complete! Time for a quick quiz!")
+        if session.current_cycle >= session.target_cycles:
+            await self.complete_study_session(context, session)
+            return
 
-                    quiz_score = await self.run_quiz(context, session)
-                    session.quiz_scores.append(quiz_score)
+        ## break time
+        session.in_break = True
 
-                    if session.current_cycle >= session.target_cycles:
-                        await self.complete_study_session(context, session)
-                        break
+        ## long or short?
+        is_long_break = session.current_cycle % 4 == 0 and session.current_cycle < session.target_cycles
+        break_duration = session.long_break_time if is_long_break else session.break_time
+        break_type = "long break" if is_long_break else "short break"
+        break_minutes = break_duration // 60
 
-                    ## break time
-                    session.in_break = True
+        note = f"☕ {break_type.title()} time! Relax for {break_minutes} minutes. Last quiz: {quiz_score:.0f}%"
+        await self.send_progress_update(context, session, "break_start", note=note)
 
-                    ## long or short?
-                    is_long_break = session.current_cycle % 4 == 0 and session.current_cycle < session.target_cycles
-                    break_duration = session.long_break_time if is_long_break else session.break_time
-                    break_type = "long break" if is_long_break else "short break"
-                    break_minutes = break_duration // 60
+        if session.is_active:
+            self.schedule_phase(session, break_duration, "break_end")
 
-                    await context.send(f"☕ {break_type.title()} time! Relax for {break_minutes} minutes. Cycle {session.current_cycle}/{session.target_cycles} complete!")
-                    await self.send_progress_update(context, session, "break_start")
+    async def end_break_phase(self, session: StudySession):
+        if session.is_active and session.current_cycle < session.target_cycles:
+            session.pending_note = f"🔔 Break's over! Cycle {session.current_cycle + 1}/{session.target_cycles} work session started."
+            await self.start_work_phase(session)
 
-                    await asyncio.sleep(break_duration)
+    async def send_progress_update(self, context, session: StudySession, phase: str, note: Optional[str] = None):
+        ## everything lands on the session's status panel, edited in place and debounced
+        if session.panel is None:
+            session.panel = StatusPanel(context, self.outbound)
 
-                    if session.is_active and session.current_cycle < session.target_cycles:
-                        await context.send(f"🔔 Break's over! Get ready for Cycle {session.current_cycle + 1}/{session.target_cycles} work session.")
-                else:
-                    break
-        except asyncio.CancelledError:
-            pass               
-    
-    async def send_progress_update(self, context, session: StudySession, phase: str):
         completed = session.current_cycle
-        remaining = session.target_cycles - completed
-
-        if phase == "work_start":
-            progress_bar = "🟢" * completed + "🔴" + "⚪" * max(0, remaining - 1)
-            status = f"🎯 **Cycle {completed}/{session.target_cycles}** - Work Session Active"
-        elif phase == "break_start":
-            progress_bar = "🟢" * completed + "⚪" * remaining
-            status = f"✅ **Cycle {completed}/{session.target_cycles}** Complete - Break Time"
-        else:
-            progress_bar = "🟢" * completed + "⚪" * remaining
-            status = f"📊 Progress: {completed}/{session.target_cycles}"
-        
-        embed = discord.Embed(
-            title="📈 Study Progress",
-            description=status,
-            color=0x3498db if phase == "break_start" else 0xe67e22
-        )
-        embed.add_field(name="Progress Bar", value=progress_bar, inline=False)
-
         remaining_work_time = max(0, session.target_cycles - completed) * 25
         remaining_breaks = max(0, session.target_cycles - completed - 1) * 5
-        estimated_remaining = remaining_work_time + remaining_breaks
 
-        if estimated_remaining > 0:
-            embed.add_field(name="⏱️ Estimated Remaining", value=f"~{estimated_remaining} minutes", inline=True)
-
-        if session.quiz_scores:
-            avg_score = sum(session.quiz_scores) / len(session.quiz_scores)
-            embed.add_field(name="🧠 Quiz Average", value=f"{avg_score:.0f}%", inline=True)
+        session.panel.update(
+            completed=completed,
+            target=session.target_cycles,
+            phase=phase,
+            remaining_minutes=remaining_work_time + remaining_breaks,
+            quiz_average=sum(session.quiz_scores) / len(session.quiz_scores) if session.quiz_scores else None,
+            note=note
+        )
 
-        await context.send(embed=embed)
+    def start_quiz_prefetch(self, session: StudySession, count: int = 3):
+        if len(session.quiz_pool) >= count:
+            return
+        if session.quiz_task and not session.quiz_task.done():
+            return
+        session.quiz_task = asyncio.create_task(self._fill_quiz_pool(session))
+
+    def stop_quiz_prefetch(self, session: StudySession):
+        if session.quiz_task and not session.quiz_task.done():
+            session.quiz_task.cancel()
+        session.quiz_task = None
+
+    async def _fill_quiz_pool(self, session: StudySession) -> List[Dict[str, Any]]:
+        ## quizzes are built from the final points, not from a half streamed list
+        if session.analysis_task:
+            await asyncio.shield(session.analysis_task)
+        variant = session.quiz_pool.generated
+        session.quiz_pool.generated += 1
+        quiz_questions = await self.generate_quiz_with_gemini(
+            session.bullet_points,
+            guild_id=session.guild_id,
+            variant=variant,
+            exclude=session.quiz_pool.asked()
+        )
+        session.quiz_pool.add(quiz_questions)
+        return quiz_questions
+
+    async def next_quiz(self, session: StudySession, count: int = 3) -> List[Dict[str, Any]]:
+        ## normally the prefetch is already done, otherwise wait for it (or start one now)
+        quiz_questions = []
+        if len(session.quiz_pool) < count:
+            if not session.quiz_task or session.quiz_task.done():
+                session.quiz_task = asyncio.create_task(self._fill_quiz_pool(session))
+            task = session.quiz_task
+            try:
+                quiz_questions = await task
+            except asyncio.CancelledError:
+                ## only the prefetch being cancelled is survivable, a stop/leave cancels
+                ## this task too and has to end the transition here
+                if not task.cancelled() or asyncio.current_task().cancelling():
+                    raise
+            session.quiz_task = None
+
+        pooled = session.quiz_pool.take(count)
+        ## everything came back as a repeat, better to ask it again than to skip the quiz
+        return pooled or quiz_questions[:count]
+
+    async def run_quiz(self, context, session: StudySession, intro: Optional[str] = None) -> int:
+        quiz_questions = await self.next_quiz(session)
+        if not quiz_questions:
+            return 0
+
+        ## a group gets one message and one set of questions, however many are in it
+        if session.is_group:
+            view = GroupQuizView(quiz_questions, session.session_id, session.participants)
+        else:
+            view = QuizView(quiz_questions, session.user_id)
+        message = await self.outbound.submit(
+            lambda: context.send(content=intro, embed=view.render(), view=view), PRIORITY_QUIZ, channel=context.channel.id
+        )
 
+        ## the view's own timeout restarts on every click, this one is the hard limit
+        try:
+            timed_out = await asyncio.wait_for(view.wait(), QUIZ_TIMEOUT)
+        except asyncio.TimeoutError:
+            view.stop()
+            timed_out = True
+        if timed_out:
+            ## grade whatever was answered and take the buttons off
+            self.outbound.submit(lambda: message.edit(embed=view.render(graded=True), view=None), PRIORITY_QUIZ,
+                                 channel=context.channel.id)
+
+        if session.is_group:
+            scores = view.scores()
+            for user_id, score in scores.items():
+                session.participants[user_id].quiz_scores.append(score)
+            ## the session's own scores are the group average per cycle
+            return sum(scores.values()) / len(scores) if scores else 0
+        return view.score()
     
-    async def run_quiz(self, context, session: StudySession) -> int:
-        quiz_questions = await self.generate_quiz(session.bullet_points)
-        correct_answers = 0
-        
-        for i, question_data in enumerate(quiz_questions, 1):
-            embed = discord.Embed(
-                title=f"📝 Quiz Question {i}/3",
-                description=question_data["question"],
-                color=0x3498db
-            )
-            
-            options_text = "\n".join([f"{key}: {value}" for key, value in question_data["options"].items()])
-            embed.add_field(name="Options", value=options_text, inline=False)
-            
-            view = QuizView(question_data["correct_answer"])
-            message = await context.send(embed=embed, view=view)
-            
 
-            await view.wait()
-            
-            if view.user_answer == question_data["correct_answer"]:
-                correct_answers += 1
-                await context.send("✅ Correct!")
-            else:
-                await context.send(f"❌ Wrong! The correct answer was {question_data['correct_answer']}")
-            
-            await asyncio.sleep(2) 
-        
-        score_percentage = (correct_answers / len(quiz_questions)) * 100
-        await context.send(f"📊 Quiz completed! Score: {correct_answers}/{len(quiz_questions)} ({score_percentage:.0f}%)")
-        
-        return score_percentage
-    
+    def log_study_session(self, session: StudySession, completed: bool = False, participant: Optional[Participant] = None):
+        ## queued, the flusher writes it in the background. group members get a row each,
+        ## covering the part of the session they were in
+        ended_at = datetime.utcnow()
+        user_id = participant.user_id if participant else session.user_id
+        start_time = participant.joined_at if participant else session.start_time
+        scores = participant.quiz_scores if participant else session.quiz_scores
+        record = {
+            'idempotency_key': f"{user_id}:{start_time.timestamp():.0f}",
+            'user_id': str(user_id),
+            'guild_id': str(session.guild_id),
+            'topic': session.topic,
+            'cycles_completed': participant.cycles_completed if participant else session.current_cycle,
+            'target_cycles': session.target_cycles,
+            'avg_quiz_score': sum(scores) / len(scores) if scores else None,
+            'duration_minutes': round((ended_at - start_time).total_seconds() / 60, 1),
+            'completed': completed,
+            'started_at': start_time.isoformat(),
+            'ended_at': ended_at.isoformat(),
+        }
+        self.session_log.enqueue(record)
+        ## totals/streaks/leaderboards are kept as rollups, !stats never scans study_sessions
+        self.rollups.add(record)
 
     async def complete_study_session(self, context, session: StudySession):
-        total_duration = (datetime.utcnow() - session.start_stime).total_seconds() / 60
-        avg_quiz_score = sum(session.quiz_scores) / len(session.quiz_scores) if session_scores else 0 
+        total_duration = (datetime.utcnow() - session.start_time).total_seconds() / 60
+        avg_quiz_score = sum(session.quiz_scores) / len(session.quiz_scores) if session.quiz_scores else 0 
 
-        await self.log_study_session(session)
+        if session.is_group:
+            for participant in session.participants.values():
+                self.log_study_session(session, completed=True, participant=participant)
+        else:
+            self.log_study_session(session, completed=True)
 
         embed = discord.Embed(
             title="🎉 Study Session Complete!",
@@ -462,6 +1317,13 @@ class StudyBuddy(commands.Bot):
         embed.add_field(name="🔄 Cycles Completed", value=f"{session.current_cycle}/{session.target_cycles}", inline=True)
         embed.add_field(name="🧠 Average Quiz Score", value=f"{avg_quiz_score:.0f}%", inline=True)
 
+        if session.is_group and session.participants:
+            lines = []
+            for participant in sorted(session.participants.values(), key=lambda p: -sum(p.quiz_scores) / max(1, len(p.quiz_scores))):
+                average = sum(participant.quiz_scores) / len(participant.quiz_scores) if participant.quiz_scores else 0
+                lines.append(f"<@{participant.user_id}>: {average:.0f}% over {participant.cycles_completed} cycles")
+            embed.add_field(name="🏅 Group Scores", value="\n".join(lines)[:1024], inline=False)
+
         ## progress bar update
         progress_bar = "🟢" * session.target_cycles
         embed.add_field(name="✅ Final Progress", value=progress_bar, inline=False)
@@ -477,32 +1339,137 @@ class StudyBuddy(commands.Bot):
         
         embed.add_field(name="🎯 Performance", value=message, inline=False)
 
-        await context.send(embed=embed)
+        await self.outbound.submit(lambda: context.send(embed=embed), PRIORITY_STATUS, channel=context.channel.id)
 
         session.is_active = False
-        if session.user_id in self.active_sessions:
-            del self.active_sessions[session.user_id]
+        self.stop_quiz_prefetch(session)
+        if self.active_sessions.get(session.session_id) is session:
+            del self.active_sessions[session.session_id]
+            self.checkpointer.remove(session.session_id)
+            for user_id in self.session_members(session):
+                await self.release_member(user_id)
+        if session.panel:
+            session.panel.close()
+
+    def session_of(self, user_id: int) -> Optional[StudySession]:
+        return self.active_sessions.get(self.group_members.get(user_id, user_id))
+
+    def session_members(self, session: StudySession) -> List[int]:
+        return list(session.participants) if session.is_group else [session.user_id]
+
+    def add_participant(self, session: StudySession, user_id: int):
+        session.participants[user_id] = Participant(user_id)
+        self.group_members[user_id] = session.session_id
+        self.studying_status.set(user_id, True)
+
+    async def release_member(self, user_id: int):
+        self.group_members.pop(user_id, None)
+        self.studying_status.set(user_id, False)
+        self.voice_index.unwatch(user_id)
+        await self.state.release(f"session:{user_id}", self.instance_id)
+
+    def teardown_session(self, session: StudySession):
+        ## stops everything the session still has running, members are released by the caller
+        session.is_active = False
+        self.scheduler.cancel(session.session_id)
+        if session.timer_task and session.timer_task is not asyncio.current_task():
+            session.timer_task.cancel()
+        self.stop_quiz_prefetch(session)
+        if session.analysis_task:
+            session.analysis_task.cancel()
+        if self.active_sessions.get(session.session_id) is session:
+            del self.active_sessions[session.session_id]
+            self.checkpointer.remove(session.session_id)
+        if session.panel:
+            session.panel.close()
+
+    async def join_group_session(self, context):
+        user_id = context.author.id
+        if self.session_of(user_id):
+            await context.send("You already have an active study session! Use `!study_stop` to end it.")
+            return
+
+        study_channel = await self.get_study_channel(context.guild)
+        session = self.active_sessions.get(study_channel.id) if study_channel else None
+        if not session or not session.is_group:
+            await context.send("There's no group session running, start one with `!study_group <cycles> <topic>`!")
+            return
+        if not context.author.voice:
+            await context.send("⚠️ Join a voice channel first, you'll be moved into the study channel!")
+            return
+
+        if not await self.state.acquire(f"session:{user_id}", self.instance_id, SESSION_LOCK_TTL):
+            await context.send("You already have an active study session in another server! Use `!study_stop` there first.")
+            return
+        if not session.is_active or self.session_of(user_id):
+            await self.state.release(f"session:{user_id}", self.instance_id)
+            return
+
+        ## no new analysis or quiz generation, the member just starts getting the group's
+        self.add_participant(session, user_id)
+        await context.author.move_to(study_channel)
+        self.voice_index.watch(user_id, context.guild.id, study_channel.id)
+        if session.context:
+            self.checkpointer.mark_dirty(session.session_id, session.to_snapshot())
+
+        phase = "on a break" if session.in_break else f"on Cycle {max(1, session.current_cycle)}/{session.target_cycles}"
+        await context.send(f"👋 {context.author.mention} joined the group session on **{session.topic}**, the group is {phase} ({len(session.participants)} studying).")
+
+    async def leave_group_session(self, session: StudySession, user_id: int):
+        participant = session.participants.pop(user_id, None)
+        if participant is None:
+            return
+        if participant.cycles_completed > 0:
+            self.log_study_session(session, participant=participant)
+        await self.release_member(user_id)
+
+        if not session.participants:
+            ## last one out, nothing left to time or quiz
+            self.teardown_session(session)
+        elif session.context:
+            self.checkpointer.mark_dirty(session.session_id, session.to_snapshot())
 
     async def cancel_study_session(self, user_id: int, guild):
-        if user_id in self.active_sessions:
-            session = self.active_sessions[user_id]
-            session.is_active = False
-            
-            if session.timer_task:
-                session.timer_task.cancel()
-            
-            # Find a text channel to send the message
+        session = self.session_of(user_id)
+        if session is None:
+            return
+
+        if session.is_group:
+            ## the rest of the group keeps going
+            await self.leave_group_session(session, user_id)
             text_channel = discord.utils.get(guild.text_channels, name="general")
             if text_channel:
-                await text_channel.send(f"📴 Study session cancelled for <@{user_id}>. You left the study channel.")
-            
-            del self.active_sessions[user_id]
+                await text_channel.send(f"📴 <@{user_id}> left the group study session.")
+            return
+
+        self.teardown_session(session)
+
+        # Find a text channel to send the message
+        text_channel = discord.utils.get(guild.text_channels, name="general")
+        if text_channel:
+            await text_channel.send(f"📴 Study session cancelled for <@{user_id}>. You left the study channel.")
+
+        await self.release_member(user_id)
     
     async def stop_study(self, context):
         user_id = context.author.id
+        session = self.session_of(user_id)
 
-        if user_id in self.active_sessions:
-            session = self.active_sessions[user_id]
+        if session and session.is_group:
+            participant = session.participants[user_id]
+            embed = discord.Embed(
+                title="📋 Study Session Summary",
+                description=f"You left the group session, {len(session.participants) - 1} still studying",
+                color=0xf39c12
+            )
+            embed.add_field(name="📚 Topic", value=session.topic, inline=False)
+            embed.add_field(name="🔄 Completed", value=f"{participant.cycles_completed} cycles", inline=True)
+            if participant.quiz_scores:
+                avg_score = sum(participant.quiz_scores) / len(participant.quiz_scores)
+                embed.add_field(name="🧠 Quiz Average", value=f"{avg_score:.0f}%", inline=True)
+            await context.send(embed=embed)
+            await self.leave_group_session(session, user_id)
+        elif session:
             if session.current_cycle > 0:
                 embed = discord.Embed(
                     title="📋 Study Session Summary",
@@ -522,7 +1489,7 @@ class StudyBuddy(commands.Bot):
                 await context.send(embed=embed)
                 
                 
-                await self.log_study_session(session)
+                self.log_study_session(session)
             else:
                 await context.send("❌ Study session stopped (no cycles completed).")
             
@@ -530,6 +1497,51 @@ class StudyBuddy(commands.Bot):
         else:
             await context.send("You don't have an active study session.")
 
+    async def show_stats(self, context, member):
+        try:
+            totals = await self.rollups.user_stats(context.guild.id, member.id)
+        except Exception as e:
+            print(f"Error loading stats: {e}")
+            await context.send("❌ Couldn't load stats right now, try again in a bit.")
+            return
+
+        if not totals['sessions']:
+            await context.send(f"{member.display_name} hasn't logged any study sessions here yet.")
+            return
+
+        embed = discord.Embed(title=f"📈 Study Stats for {member.display_name}", color=0x3498db)
+        embed.add_field(name="⏱️ Time Studied", value=f"{totals['minutes'] / 60:.1f} h", inline=True)
+        embed.add_field(name="🔄 Cycles", value=str(totals['cycles']), inline=True)
+        embed.add_field(name="📚 Sessions", value=str(totals['sessions']), inline=True)
+        if totals['avg_quiz'] is not None:
+            embed.add_field(name="🧠 Quiz Average", value=f"{totals['avg_quiz']:.0f}%", inline=True)
+        embed.add_field(name="🔥 Streak", value=f"{totals['current_streak']} days (best {totals['best_streak']})", inline=True)
+        await context.send(embed=embed)
+
+    async def show_leaderboard(self, context, days: int):
+        days = max(1, min(days, 30))
+        try:
+            board = await self.rollups.leaderboard(context.guild.id, days=days)
+        except Exception as e:
+            print(f"Error loading leaderboard: {e}")
+            await context.send("❌ Couldn't load the leaderboard right now, try again in a bit.")
+            return
+
+        if not board['ranking']:
+            await context.send(f"No study sessions in the last {days} days yet.")
+            return
+
+        lines = []
+        for place, row in enumerate(board['ranking'], start=1):
+            member = context.guild.get_member(row['user_id'])
+            name = member.display_name if member else f"<@{row['user_id']}>"
+            quiz = f" · 🧠 {row['avg_quiz']:.0f}%" if row['avg_quiz'] is not None else ""
+            lines.append(f"**{place}.** {name} — {row['minutes'] / 60:.1f} h · {row['cycles']} cycles{quiz}")
+
+        embed = discord.Embed(title=f"🏆 Leaderboard (last {days} days)", description="\n".join(lines), color=0xf1c40f)
+        embed.set_footer(text=f"Server total: {board['guild_minutes'] / 60:.1f} h over {board['guild_sessions']} sessions")
+        await context.send(embed=embed)
+
 ## loading env variables
 # load_dotenv()
 
@@ -0,0 +1,129 @@
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from client import get_supabase
+from metrics import metrics
+
+
+class DBTimeoutError(Exception):
+    pass
+
+
+class LoopStallMonitor:
+    ## wakes up every `interval` seconds and measures how late it was,
+    ## anything blocking the loop (sync http, pdf parsing...) shows up as lag
+
+    def __init__(self, interval: float = 0.5, stall_threshold: float = 0.1):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stall_count = 0
+        self.total_stall_time = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                expected = loop.time() + self.interval
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, loop.time() - expected)
+
+                self.last_lag = lag
+                self.max_lag = max(self.max_lag, lag)
+                if lag >= self.stall_threshold:
+                    self.stall_count += 1
+                    self.total_stall_time += lag
+        except asyncio.CancelledError:
+            pass
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            'last_lag': self.last_lag,
+            'max_lag': self.max_lag,
+            'stall_count': self.stall_count,
+            'total_stall_time': self.total_stall_time,
+        }
+
+
+class AsyncDB:
+    ## the supabase client is sync, so every .execute() is a blocking http round trip.
+    ## queries are still built on the loop (that part is cheap), only .execute() runs
+    ## on a bounded worker pool. without a client the default one is created on first
+    ## use, call warm() to have that happen on a worker thread instead of the loop
+
+    def __init__(self, client=None, max_workers: int = 8, timeout: float = 10.0):
+        self._client = client
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="supabase")
+        self._slots = asyncio.Semaphore(max_workers)
+
+        self.calls = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.total_time = 0.0
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_supabase()
+        return self._client
+
+    async def warm(self):
+        if self._client is None:
+            self._client = await asyncio.get_running_loop().run_in_executor(self._executor, get_supabase)
+
+    def table(self, name: str):
+        return self.client.table(name)
+
+    async def execute(self, query, timeout: Optional[float] = None):
+        ## postgrest builders know their http method (older versions on the builder,
+        ## newer ones on .request), GET is a read and everything else a write
+        method = getattr(query, 'http_method', None) or getattr(getattr(query, 'request', None), 'http_method', None)
+        span = "supabase.read" if method == 'GET' else "supabase.write"
+        return await self.run(query.execute, timeout=timeout, span=span)
+
+    async def run(self, fn: Callable[..., Any], *args, timeout: Optional[float] = None,
+                  span: str = "supabase.call", **kwargs):
+        loop = asyncio.get_running_loop()
+        timeout = timeout if timeout is not None else self.timeout
+
+        async with self._slots:
+            self.calls += 1
+            start = time.perf_counter()
+            future = loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+            try:
+                with metrics.span(span):
+                    return await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise DBTimeoutError(f"Supabase call timed out after {timeout}s")
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                self.total_time += time.perf_counter() - start
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'calls': self.calls,
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+            'avg_latency': self.total_time / self.calls if self.calls else 0.0,
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,163 @@
+## offline load test: N concurrent study sessions against fake discord/gemini/supabase
+## on a virtual clock, no bot token or api keys needed.
+## usage: python bench_load.py --sessions 1000 --speed 200 [--json out.json] [--max-p99 5]
+## with --group everyone in a guild studies in one group session (!study_group + !study_join)
+## real cpu time gets multiplied by --speed too, so very high speeds inflate the latencies
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+## the fake gemini model needs no warming and the fake documents are never pdfs
+os.environ.setdefault("STUDYBUDDY_WARMUP", "0")
+
+from loadtest_fakes import ApiCounter, FakeDiscord, FakeGeminiModel, FakeSupabase, VirtualClockLoop
+
+TOPICS = [f"Lecture {i}: " + " ".join(f"concept{i}_{j}" for j in range(200)) for i in range(50)]
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))] if samples else 0.0
+
+
+async def run(args):
+    from StudyBuddy import StudyBuddy
+
+    loop = asyncio.get_running_loop()
+    counter = ApiCounter()
+    fake_discord = FakeDiscord(counter, guilds=args.guilds, latency=args.discord_latency)
+    bot = StudyBuddy(
+        supabase_client=FakeSupabase(counter, args.speed, latency=args.db_latency),
+        gemini_model=FakeGeminiModel(counter, latency=args.llm_latency),
+    )
+
+    ## what on_ready would start, without a gateway connection
+    bot.loop_monitor.interval = 0.5 * args.speed
+    bot.loop_monitor.stall_threshold = 0.05 * args.speed
+    await bot.start_services([guild.id for guild in fake_discord.guilds])
+
+    command_latency = []
+    members = []
+
+    async def start(user_id):
+        member = fake_discord.member(user_id)
+        members.append(member)
+        await asyncio.sleep(random.uniform(0, args.ramp))
+        if args.group and user_id > len(fake_discord.guilds):
+            ## the first member of each guild starts the group, everyone else joins it
+            while member.guild.study_channel.id not in bot.active_sessions:
+                await asyncio.sleep(5)
+            started = loop.time()
+            await bot.join_group_session(fake_discord.context(member))
+        else:
+            started = loop.time()
+            await bot.start_study_session(fake_discord.context(member), args.cycles, topic_text=random.choice(TOPICS),
+                                          group=args.group)
+        command_latency.append(loop.time() - started)
+
+    async def churn():
+        ## some users drop out and come straight back, a few leave for good
+        while bot.active_sessions:
+            await asyncio.sleep(60)
+            for member in random.sample(members, max(1, len(members) // 100)):
+                if bot.session_of(member.id) is None:
+                    continue
+                await bot.on_voice_state_update(*fake_discord.voice_event(member, None))
+                if random.random() < 0.8:
+                    await asyncio.sleep(random.uniform(1, 5))
+                    await bot.on_voice_state_update(*fake_discord.voice_event(member, member.guild.study_channel))
+
+    ## tracemalloc is exact but slows everything down, max rss is free but coarse
+    if args.tracemalloc:
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+    else:
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    wall_start = time.perf_counter()
+
+    await asyncio.gather(*[start(user_id) for user_id in range(1, args.sessions + 1)])
+    if args.tracemalloc:
+        used = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+    else:
+        used = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - baseline
+    memory_per_session = used / max(1, len(bot.active_sessions))
+    participants = len(bot.group_members) if args.group else len(bot.active_sessions)
+
+    churner = asyncio.create_task(churn())
+    while bot.active_sessions:
+        await asyncio.sleep(30)
+    churner.cancel()
+
+    wall = time.perf_counter() - wall_start
+    await bot.session_log.close()
+    await bot.studying_status.close()
+    await bot.checkpointer.close()
+    bot.scheduler.stop()
+    bot.outbound.stop()
+    bot.loop_monitor.stop()
+
+    return {
+        'sessions': args.sessions,
+        'group': args.group,
+        'participants': participants,
+        'virtual_minutes': round((wall * args.speed) / 60, 1),
+        'wall_seconds': round(wall, 2),
+        'command_p50_s': round(percentile(command_latency, 0.5), 3),
+        'command_p99_s': round(percentile(command_latency, 0.99), 3),
+        'loop_lag_max_ms': round(bot.loop_monitor.max_lag / args.speed * 1000, 2),
+        'loop_stalls': bot.loop_monitor.stall_count,
+        'memory_per_session_kb': round(memory_per_session / 1024, 2),
+        'api_calls': dict(sorted(counter.calls.items())),
+        'gemini': bot.gemini.stats(),
+        'content_cache': bot.content_cache.stats(),
+        'timer_jitter_s': bot.scheduler.jitter(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--guilds", type=int, default=100)
+    parser.add_argument("--cycles", type=int, default=2)
+    parser.add_argument("--speed", type=float, default=200, help="virtual seconds per real second")
+    parser.add_argument("--ramp", type=float, default=120, help="virtual seconds over which sessions start")
+    parser.add_argument("--llm-latency", type=float, default=3.0)
+    parser.add_argument("--db-latency", type=float, default=0.05)
+    parser.add_argument("--discord-latency", type=float, default=0.1)
+    parser.add_argument("--group", action="store_true", help="one group session per guild instead of one per user")
+    parser.add_argument("--tracemalloc", action="store_true", help="exact memory per session, slower")
+    parser.add_argument("--json", help="also write the report here")
+    parser.add_argument("--max-p99", type=float, help="exit non-zero if command p99 (virtual s) is above this")
+    args = parser.parse_args()
+
+    random.seed(42)
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    ## keep the sqlite caches/checkpoints of the run out of the working tree
+    workdir = tempfile.mkdtemp(prefix="studybuddy-load-")
+    os.chdir(workdir)
+
+    with asyncio.Runner(loop_factory=lambda: VirtualClockLoop(args.speed)) as runner:
+        report = runner.run(run(args))
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(report, out, indent=2)
+
+    if args.max_p99 is not None and report['command_p99_s'] > args.max_p99:
+        print(f"command p99 {report['command_p99_s']}s is above {args.max_p99}s", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+## benchmark for pdf_extract: old inline extraction vs the process pool
+## usage: python bench_pdf_extraction.py
+
+import asyncio
+import time
+
+from pdf_extract import extract_pdf_text, extract_pdf_text_sync, shutdown_pool
+
+
+def make_pdf(pages: int, lines_per_page: int = 40, scanned: bool = False) -> bytes:
+    ## tiny hand written pdf so the benchmark needs nothing besides PyPDF2.
+    ## "scanned" pages have no text operators, like an image-only scan
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+
+    for page in range(pages):
+        if scanned:
+            stream = b"0.9 g 0 0 612 792 re f"
+        else:
+            lines = [f"BT /F1 10 Tf 40 {750 - i * 17} Td (Page {page} line {i} lorem ipsum dolor sit amet) Tj ET"
+                     for i in range(lines_per_page)]
+            stream = "\n".join(lines).encode('latin-1')
+
+        content_id = len(objects) + 1
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_id = len(objects) + 1
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        kids.append(b"%d 0 R" % page_id)
+
+    objects[1] = b"<< /Type /Pages /Kids [" + b" ".join(kids) + b"] /Count %d >>" % pages
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+async def measure_lag(coro):
+    ## how long the loop went without being able to run anything else
+    loop = asyncio.get_running_loop()
+    worst = 0.0
+    running = True
+
+    async def ticker():
+        nonlocal worst
+        while running:
+            before = loop.time()
+            await asyncio.sleep(0.01)
+            worst = max(worst, loop.time() - before - 0.01)
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    result = await coro
+    elapsed = time.perf_counter() - start
+    running = False
+    await tick
+    return result, elapsed, worst
+
+
+async def main():
+    cases = [
+        ("small (5 pages)", make_pdf(5)),
+        ("large (300 pages)", make_pdf(300)),
+        ("scanned (50 pages)", make_pdf(50, scanned=True)),
+    ]
+
+    ## warm the pool so worker start-up isn't charged to the first case
+    await extract_pdf_text(make_pdf(1))
+
+    print(f"{'case':<22}{'mode':<8}{'seconds':>10}{'max lag':>10}  result")
+    for name, data in cases:
+        async def inline():
+            return extract_pdf_text_sync(data)
+
+        for mode, coro in (("inline", inline()), ("pool", extract_pdf_text(data))):
+            result, elapsed, lag = await measure_lag(coro)
+            print(f"{name:<22}{mode:<8}{elapsed:>10.3f}{lag:>10.3f}  {result.describe()}")
+
+    shutdown_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
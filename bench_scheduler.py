@@ -0,0 +1,103 @@
+## memory and timer jitter at 10k concurrent sessions:
+## one sleeping task per session (the old run_pomodoro_cycle) vs TimerScheduler
+## usage: python bench_scheduler.py [sessions]
+
+import asyncio
+import random
+import sys
+import time
+import tracemalloc
+
+from scheduler import TimerScheduler
+
+PHASES = 3  ## work_end -> break_end -> work_end
+
+
+class FakeContext:
+    ## what the old per-session task kept alive for the whole cycle
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.payload = bytearray(256)
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))] if samples else 0.0
+
+
+async def run_tasks(sessions: int, delays):
+    loop = asyncio.get_running_loop()
+    lateness = []
+    done = asyncio.Event()
+    remaining = sessions
+
+    async def cycle(context, delay):
+        nonlocal remaining
+        for _ in range(PHASES):
+            deadline = loop.time() + delay
+            await asyncio.sleep(delay)
+            lateness.append(loop.time() - deadline)
+        remaining -= 1
+        if remaining == 0:
+            done.set()
+
+    tracemalloc.start()
+    tasks = [asyncio.create_task(cycle(FakeContext(i), delays[i])) for i in range(sessions)]
+    await asyncio.sleep(0)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    await done.wait()
+    del tasks
+    return memory, lateness
+
+
+async def run_scheduler(sessions: int, delays):
+    done = asyncio.Event()
+    phases_left = {}
+    scheduler = None
+
+    async def handler(session_id, phase):
+        phases_left[session_id] -= 1
+        if phases_left[session_id]:
+            scheduler.schedule(session_id, delays[session_id], phase)
+        else:
+            del phases_left[session_id]
+            if not phases_left:
+                done.set()
+
+    tracemalloc.start()
+    scheduler = TimerScheduler(handler, jitter_samples=sessions * PHASES)
+    contexts = [FakeContext(i) for i in range(sessions)]
+    for i in range(sessions):
+        phases_left[i] = PHASES
+        scheduler.schedule(i, delays[i], "work_end")
+    await asyncio.sleep(0)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    await done.wait()
+    scheduler.stop()
+    del contexts
+    return memory, list(scheduler.lateness)
+
+
+async def main():
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    random.seed(7)
+    ## real cycles are minutes long, compressed here so the run takes a few seconds
+    delays = [random.uniform(0.5, 1.5) for _ in range(sessions)]
+
+    print(f"{sessions} sessions x {PHASES} phases")
+    print(f"{'mode':<12}{'KB/session':>12}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'wall s':>10}")
+    for name, runner in (("task/session", run_tasks), ("scheduler", run_scheduler)):
+        start = time.perf_counter()
+        memory, lateness = await runner(sessions, delays)
+        wall = time.perf_counter() - start
+        print(f"{name:<12}{memory / sessions / 1024:>12.2f}"
+              f"{percentile(lateness, 0.5) * 1000:>10.2f}{percentile(lateness, 0.99) * 1000:>10.2f}"
+              f"{max(lateness) * 1000:>10.2f}{wall:>10.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+## startup benchmark: time from `import StudyBuddy` to the bot being ready (constructed and
+## start_services done, everything on_ready does besides the gateway), in fresh processes.
+## "lazy" is the bot as it is, "eager" imports PyPDF2/gemini/supabase/aiohttp up front
+## like the bot used to. supabase is a fake so no network is needed.
+## usage: python bench_startup.py [--runs 5] [--guilds 100]
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HEAVY = ["PyPDF2", "google.generativeai", "supabase", "aiohttp"]
+REPO = os.path.dirname(os.path.abspath(__file__))
+
+
+def child(mode: str, guilds: int):
+    started = time.perf_counter()
+    if mode == "eager":
+        import importlib
+        for name in HEAVY:
+            importlib.import_module(name)
+
+    import asyncio
+    from StudyBuddy import StudyBuddy
+    from loadtest_fakes import ApiCounter, FakeSupabase
+    imported = time.perf_counter()
+
+    async def ready():
+        bot = StudyBuddy(supabase_client=FakeSupabase(ApiCounter(), speed=1, latency=0.0, jitter=0.0))
+        await bot.start_services(list(range(1, guilds + 1)))
+        done = time.perf_counter()
+        await bot.session_log.close()
+        await bot.checkpointer.close()
+        bot.loop_monitor.stop()
+        return done
+
+    done = asyncio.run(ready())
+    print(json.dumps({
+        'import_s': imported - started,
+        'ready_s': done - started,
+        'heavy_loaded': [name for name in HEAVY if name in sys.modules],
+    }))
+
+
+def measure(mode: str, guilds: int) -> dict:
+    env = dict(os.environ, STUDYBUDDY_WARMUP="0")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO, env.get("PYTHONPATH")]))
+    with tempfile.TemporaryDirectory(prefix="studybuddy-startup-") as workdir:
+        out = subprocess.run(
+            [sys.executable, "-W", "ignore", os.path.abspath(__file__), "--child", mode, "--guilds", str(guilds)],
+            cwd=workdir, env=env, capture_output=True, text=True, check=True
+        )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--guilds", type=int, default=100)
+    parser.add_argument("--child", choices=["lazy", "eager"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.guilds)
+        return
+
+    for mode in ("eager", "lazy"):
+        samples = [measure(mode, args.guilds) for _ in range(args.runs)]
+        import_s = statistics.median(sample['import_s'] for sample in samples)
+        ready_s = statistics.median(sample['ready_s'] for sample in samples)
+        print(f"{mode:>5}: import {import_s * 1000:7.1f} ms   import->ready {ready_s * 1000:7.1f} ms"
+              f"   heavy modules loaded: {', '.join(samples[0]['heavy_loaded']) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
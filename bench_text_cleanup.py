@@ -0,0 +1,132 @@
+## benchmark for text_cleanup: prompt tokens and modelled analysis latency, raw vs normalized.
+## the default corpus is synthetic lecture notes (headers, footers, page numbers, hyphenated
+## wraps, slides repeated); --corpus DIR adds every .txt/.md/.pdf in DIR.
+## gemini latency is modelled as base + per 1k input tokens and run on the virtual clock
+## usage: python bench_text_cleanup.py [--corpus notes/] [--base 2.0] [--per-1k 0.4]
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from types import SimpleNamespace
+
+from content_cache import ContentCache
+from gemini_gateway import GeminiGateway
+from loadtest_fakes import VirtualClockLoop
+from summarize import ChunkSummarizer, estimate_tokens
+from text_cleanup import PAGE_BREAK, TextNormalizer
+
+WORDS = ("algorithm graph vertex edge weight shortest path dynamic programming recurrence "
+         "complexity asymptotic bound heap queue stack invariant proof induction greedy "
+         "matroid flow network cut capacity residual augmenting hashing collision probe").split()
+
+
+def lecture(number: int, pages: int, rng: random.Random) -> str:
+    slides = []
+    for page in range(1, pages + 1):
+        lines = ["CS 201 - Algorithms and Data Structures", f"Lecture {number}: Graph Algorithms"]
+        for _ in range(3):
+            sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(25, 45))).capitalize() + "."
+            ## hard wraps at ~70 columns, sometimes in the middle of a word
+            while len(sentence) > 70:
+                cut = rng.randint(55, 70)
+                if sentence[cut - 1].isalpha() and sentence[cut].isalpha():
+                    lines.append(sentence[:cut] + "-")
+                else:
+                    lines.append(sentence[:cut].rstrip())
+                sentence = sentence[cut:].lstrip()
+            lines.append(sentence)
+            lines.append("")
+        lines += ["University of Example - Fall Term - All rights reserved", f"Page {page} of {pages}"]
+        slides.append("\n".join(lines))
+        ## recap slides repeat an earlier one word for word
+        if page % 6 == 0:
+            slides.append(slides[rng.randrange(len(slides) - 1)])
+    return PAGE_BREAK.join(slides)
+
+
+def load_corpus(directory: str):
+    from pdf_extract import extract_pdf_text_sync
+
+    documents = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.endswith((".txt", ".md")):
+            with open(path, encoding="utf-8", errors="replace") as handle:
+                documents.append((name, handle.read()))
+        elif name.endswith(".pdf"):
+            with open(path, "rb") as handle:
+                documents.append((name, extract_pdf_text_sync(handle.read()).text))
+    return documents
+
+
+class LatencyModel:
+    def __init__(self, base: float, per_1k: float):
+        self.base = base
+        self.per_1k = per_1k
+        self.calls = 0
+
+    async def generate_content_async(self, prompt: str):
+        self.calls += 1
+        await asyncio.sleep(self.base + estimate_tokens(prompt) / 1000 * self.per_1k)
+        return SimpleNamespace(text="- summarized point")
+
+
+async def analyze_latency(documents, args, workdir: str):
+    ## condense (parallel chunk summaries) + the final analyze call, as analyze_study_material does
+    model = LatencyModel(args.base, args.per_1k)
+    gateway = GeminiGateway(model=model, timeout=3600)
+    cache = ContentCache(path=os.path.join(workdir, f"cache-{random.random()}.sqlite3"))
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    condensed = await ChunkSummarizer(gateway, cache).condense(documents)
+    await gateway.generate(condensed.text)
+    cache.close()
+    return loop.time() - start, model.calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", help="directory with .txt/.md/.pdf files to add")
+    parser.add_argument("--lectures", type=int, default=6)
+    parser.add_argument("--pages", type=int, default=30)
+    parser.add_argument("--base", type=float, default=2.0, help="seconds per gemini call")
+    parser.add_argument("--per-1k", type=float, default=0.4, help="extra seconds per 1k prompt tokens")
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    corpus = [(f"lecture-{n}", lecture(n, args.pages, rng)) for n in range(1, args.lectures + 1)]
+    if args.corpus:
+        corpus += load_corpus(args.corpus)
+
+    workdir = tempfile.mkdtemp(prefix="studybuddy-cleanup-")
+    print(f"{'document':<24}{'tokens in':>10}{'tokens out':>11}{'saved':>8}{'clean ms':>10}"
+          f"{'latency raw':>13}{'latency clean':>15}{'calls':>9}")
+
+    totals = [0, 0, 0.0, 0.0]
+    for name, text in corpus:
+        normalizer = TextNormalizer()
+        started = time.perf_counter()
+        cleaned = normalizer.normalize_documents([text])
+        clean_ms = (time.perf_counter() - started) * 1000
+
+        with asyncio.Runner(loop_factory=lambda: VirtualClockLoop(20)) as runner:
+            raw_latency, raw_calls = runner.run(analyze_latency([text.replace(PAGE_BREAK, "\n")], args, workdir))
+            clean_latency, clean_calls = runner.run(analyze_latency(cleaned, args, workdir))
+
+        saved = normalizer.tokens_saved / max(1, normalizer.tokens_in)
+        print(f"{name[:23]:<24}{normalizer.tokens_in:>10}{normalizer.tokens_out:>11}{saved:>8.0%}{clean_ms:>10.1f}"
+              f"{raw_latency:>12.1f}s{clean_latency:>14.1f}s{raw_calls:>5}->{clean_calls}")
+        totals[0] += normalizer.tokens_in
+        totals[1] += normalizer.tokens_out
+        totals[2] += raw_latency
+        totals[3] += clean_latency
+
+    print(f"\ntotal: {totals[0]} -> {totals[1]} tokens ({1 - totals[1] / max(1, totals[0]):.0%} fewer), "
+          f"modelled analysis latency {totals[2]:.1f}s -> {totals[3]:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+## replays a synthetic voice-event firehose against StudyBuddy.on_voice_state_update
+## usage: python bench_voice_events.py [events]
+## needs the bot's dependencies installed, client.py still wants SUPABASE_URL/KEY set
+
+import asyncio
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+from StudyBuddy import StudyBuddy
+from voice_index import VoiceIndex
+
+GUILDS = 2000
+STUDYING_USERS = 5000
+
+
+class FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+
+
+def make_events(count: int):
+    ## ~2% of events belong to someone studying, the rest is every other voice channel on discord
+    random.seed(3)
+    events = []
+    for _ in range(count):
+        guild_id = random.randrange(GUILDS)
+        if random.random() < 0.02:
+            user_id = random.randrange(STUDYING_USERS)
+            guild_id = user_id % GUILDS
+            ## mostly moving around inside the study channel, sometimes a drop + rejoin
+            after = FakeChannel(guild_id * 10) if random.random() < 0.7 else None
+        else:
+            user_id = STUDYING_USERS + random.randrange(10 ** 6)
+            after = FakeChannel(guild_id * 10 + random.randrange(1, 5))
+        member = SimpleNamespace(id=user_id, guild=SimpleNamespace(id=guild_id))
+        events.append((member, SimpleNamespace(channel=None), SimpleNamespace(channel=after)))
+    return events
+
+
+def make_bot():
+    cancelled = []
+
+    async def cancel_study_session(user_id, guild):
+        cancelled.append(user_id)
+
+    bot = SimpleNamespace(voice_index=VoiceIndex(grace=0.05), cancel_study_session=cancel_study_session, cancelled=cancelled)
+    for user_id in range(STUDYING_USERS):
+        guild_id = user_id % GUILDS
+        bot.voice_index.watch(user_id, guild_id, guild_id * 10)
+    return bot
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    events = make_events(count)
+    bot = make_bot()
+    handler = StudyBuddy.on_voice_state_update
+
+    latencies = []
+    start = time.perf_counter()
+    for member, before, after in events:
+        event_start = time.perf_counter()
+        await handler(bot, member, before, after)
+        latencies.append(time.perf_counter() - event_start)
+    elapsed = time.perf_counter() - start
+
+    ## let the grace timers run out so the debounce numbers are final
+    await asyncio.sleep(0.1)
+
+    latencies.sort()
+    print(f"{count} events in {elapsed:.2f}s ({count / elapsed:,.0f} events/s)")
+    print(f"p50 {latencies[len(latencies) // 2] * 1e6:.2f} us, p99 {latencies[int(len(latencies) * 0.99)] * 1e6:.2f} us")
+    print(f"reconnects debounced: {bot.voice_index.debounced}, sessions cancelled: {len(bot.cancelled)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
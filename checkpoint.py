@@ -0,0 +1,162 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+SNAPSHOT_VERSION = 1
+
+
+class RestoredContext:
+    ## stands in for the commands.Context of a session that survived a restart,
+    ## only what the session code uses: send, guild, author, channel
+
+    def __init__(self, channel, author):
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+
+    async def send(self, *args, **kwargs):
+        return await self.channel.send(*args, **kwargs)
+
+
+class SessionCheckpointer:
+    ## sessions get marked dirty on phase changes, a background flusher writes all
+    ## dirty snapshots (and removals) in one sqlite transaction every `interval`
+    ## seconds, plus one supabase upsert/delete per flush when a db is given
+
+    def __init__(self, path: Optional[str] = None, db=None, table: str = 'active_sessions', interval: float = 5.0):
+        self.path = path or os.getenv("STUDYBUDDY_SESSIONS_PATH", "sessions.sqlite3")
+        self.db = db
+        self.table = table
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS active_sessions ("
+            " user_id INTEGER PRIMARY KEY, snapshot TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+        self._dirty: Dict[int, Dict[str, Any]] = {}
+        self._removed = set()
+        self._task: Optional[asyncio.Task] = None
+
+        self.flushes = 0
+        self.rows_written = 0
+
+    def mark_dirty(self, user_id: int, snapshot: Dict[str, Any]):
+        snapshot['v'] = SNAPSHOT_VERSION
+        self._removed.discard(user_id)
+        self._dirty[user_id] = snapshot
+
+    def remove(self, user_id: int):
+        self._dirty.pop(user_id, None)
+        self._removed.add(user_id)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                await self.flush()
+        except asyncio.CancelledError:
+            pass
+
+    async def flush(self):
+        if not self._dirty and not self._removed:
+            return
+
+        dirty, self._dirty = self._dirty, {}
+        removed, self._removed = self._removed, set()
+        now = time.time()
+        rows = [(user_id, json.dumps(snapshot, separators=(',', ':')), now) for user_id, snapshot in dirty.items()]
+
+        try:
+            await asyncio.to_thread(self._write, rows, list(removed))
+        except Exception as e:
+            print(f"Error writing session checkpoints: {e}")
+            ## put them back unless something newer came in meanwhile
+            for user_id, snapshot in dirty.items():
+                self._dirty.setdefault(user_id, snapshot)
+            self._removed |= removed - set(self._dirty)
+            return
+
+        self.flushes += 1
+        self.rows_written += len(rows)
+
+        if self.db is not None:
+            try:
+                if rows:
+                    await self.db.execute(self.db.table(self.table).upsert([
+                        {'user_id': str(user_id), 'snapshot': snapshot, 'updated_at': updated_at}
+                        for user_id, snapshot, updated_at in rows
+                    ]))
+                if removed:
+                    await self.db.execute(
+                        self.db.table(self.table).delete().in_('user_id', [str(user_id) for user_id in removed])
+                    )
+            except Exception as e:
+                print(f"Error writing session checkpoints to Supabase: {e}")
+
+    def _write(self, rows, removed: List[int]):
+        with self._lock:
+            with self._conn:
+                if rows:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO active_sessions (user_id, snapshot, updated_at) VALUES (?, ?, ?)", rows
+                    )
+                if removed:
+                    self._conn.executemany("DELETE FROM active_sessions WHERE user_id = ?", [(user_id,) for user_id in removed])
+
+    def _read(self):
+        with self._lock:
+            return self._conn.execute("SELECT user_id, snapshot, updated_at FROM active_sessions").fetchall()
+
+    async def load(self) -> List[Dict[str, Any]]:
+        ## what's still waiting for the flusher is newer than anything on disk, removed
+        ## sessions stay removed and dirty snapshots win
+        latest: Dict[int, tuple] = {}
+        for user_id, snapshot, updated_at in await asyncio.to_thread(self._read):
+            latest[user_id] = (updated_at, snapshot)
+
+        if self.db is not None:
+            try:
+                response = await self.db.execute(self.db.table(self.table).select('*'))
+                for row in response.data or []:
+                    user_id = int(row['user_id'])
+                    if user_id not in latest or float(row['updated_at']) > latest[user_id][0]:
+                        latest[user_id] = (float(row['updated_at']), row['snapshot'])
+            except Exception as e:
+                print(f"Error loading session checkpoints from Supabase: {e}")
+
+        for user_id in self._removed:
+            latest.pop(user_id, None)
+        for user_id, snapshot in self._dirty.items():
+            latest[user_id] = (time.time(), dict(snapshot))
+
+        snapshots = []
+        for user_id, (_, snapshot) in latest.items():
+            try:
+                data = json.loads(snapshot) if isinstance(snapshot, str) else snapshot
+            except ValueError:
+                continue
+            ## older/newer formats are dropped rather than half-restored
+            if data.get('v') == SNAPSHOT_VERSION:
+                snapshots.append(data)
+        return snapshots
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        with self._lock:
+            self._conn.close()
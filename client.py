@@ -1,6 +1,30 @@
-from supabase import create_client, Client
 import os
+import threading
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from supabase import Client
 
 url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+
+## importing supabase pulls in httpx/postgrest/realtime, only pay for it on first use
+_client: Optional["Client"] = None
+_lock = threading.Lock()
+
+
+def get_supabase() -> "Client":
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                from supabase import create_client
+                _client = create_client(url, key)
+    return _client
+
+
+def __getattr__(name: str):
+    ## `from client import supabase` still works, it just creates the client right there
+    if name == "supabase":
+        return get_supabase()
+    raise AttributeError(f"module 'client' has no attribute {name!r}")
@@ -0,0 +1,72 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+
+class ConfigCache:
+    ## bounded LRU of guild_id -> server config with a TTL per entry.
+    ## every entry carries the row's `version`, a write that comes back with an
+    ## older version than a live entry (slow prefetch racing a save) is ignored.
+    ## once an entry has expired the database is authoritative again, any reload wins
+
+    def __init__(self, maxsize: int = 5000, ttl: float = 600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, guild_id: int):
+        return self.get(guild_id, count=False) is not None
+
+    def get(self, guild_id: int, count: bool = True) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(guild_id)
+
+        if entry is None or entry['expires_at'] <= time.monotonic():
+            if count:
+                self.misses += 1
+            return None
+
+        self._entries.move_to_end(guild_id)
+        if count:
+            self.hits += 1
+        return entry['config']
+
+    def put(self, guild_id: int, config: Dict[str, Any], version: int = 0) -> bool:
+        now = time.monotonic()
+        entry = self._entries.get(guild_id)
+        if entry and entry['expires_at'] > now and version < entry['version']:
+            return False
+
+        self._entries[guild_id] = {
+            'config': config,
+            'version': version,
+            'expires_at': now + self.ttl,
+        }
+        self._entries.move_to_end(guild_id)
+
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return True
+
+    def invalidate(self, guild_id: int):
+        self._entries.pop(guild_id, None)
+
+    def missing(self, guild_ids: Iterable[int]) -> List[int]:
+        return [guild_id for guild_id in guild_ids if self.get(guild_id, count=False) is None]
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
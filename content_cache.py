@@ -0,0 +1,162 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+def normalize_content(text: str) -> str:
+    ## same material with different spacing/line endings should hash the same
+    text = unicodedata.normalize('NFKC', text)
+    return " ".join(text.split())
+
+
+def content_key(kind: str, text: str, prompt_version: int) -> str:
+    digest = hashlib.sha256(normalize_content(text).encode('utf-8')).hexdigest()
+    return f"{kind}:v{prompt_version}:{digest}"
+
+
+class ContentCache:
+    ## llm results keyed by (kind, prompt version, hash of normalized input).
+    ## lookups go memory LRU -> local sqlite file -> (optional) supabase table,
+    ## writes go to all of them, supabase in the background. the sqlite file is
+    ## pruned every `prune_every` writes: rows older than `max_age` go, and only the
+    ## newest `max_disk_entries` are kept
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 2000, db=None,
+                 table: str = 'content_cache', max_disk_entries: int = 50000,
+                 max_age: float = 30 * 24 * 3600, prune_every: int = 100):
+        self.path = path or os.getenv("STUDYBUDDY_CACHE_PATH", "study_cache.sqlite3")
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.max_age = max_age
+        self.prune_every = prune_every
+        self.db = db
+        self.table = table
+
+        self._memory: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA mmap_size=67108864")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS content_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS content_cache_created_at ON content_cache (created_at)")
+        self._conn.commit()
+        self._pending = set()
+        self._disk_writes = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.remote_hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.disk_evicted = 0
+
+    async def get(self, kind: str, text: str, prompt_version: int) -> Optional[Any]:
+        key = content_key(kind, text, prompt_version)
+
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            self.bytes_saved += len(text.encode('utf-8'))
+            return self._memory[key]
+
+        value = await asyncio.to_thread(self._disk_get, key)
+        if value is not None:
+            self.disk_hits += 1
+        elif self.db is not None:
+            value = await self._remote_get(key)
+            if value is not None:
+                self.remote_hits += 1
+                await asyncio.to_thread(self._disk_put, key, value)
+
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.bytes_saved += len(text.encode('utf-8'))
+        self._remember(key, value)
+        return value
+
+    async def put(self, kind: str, text: str, prompt_version: int, value: Any):
+        key = content_key(kind, text, prompt_version)
+        self._remember(key, value)
+        await asyncio.to_thread(self._disk_put, key, value)
+
+        if self.db is not None:
+            ## write-back, nobody waits on supabase for this
+            task = asyncio.get_running_loop().create_task(self._remote_put(key, value))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    def _remember(self, key: str, value: Any):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM content_cache WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _disk_put(self, key: str, value: Any):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO content_cache (key, value, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time())
+            )
+            self._disk_writes += 1
+            if self._disk_writes % self.prune_every == 0:
+                self._prune()
+            self._conn.commit()
+
+    def _prune(self):
+        ## called with the lock held, commits with the write that triggered it
+        cursor = self._conn.execute(
+            "DELETE FROM content_cache WHERE created_at < ? OR key IN"
+            " (SELECT key FROM content_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (time.time() - self.max_age, self.max_disk_entries)
+        )
+        self.disk_evicted += cursor.rowcount
+
+    async def _remote_get(self, key: str) -> Optional[Any]:
+        try:
+            response = await self.db.execute(self.db.table(self.table).select('value').eq('key', key))
+            if response.data:
+                return json.loads(response.data[0]['value'])
+        except Exception as e:
+            print(f"Error reading content cache from Supabase: {e}")
+        return None
+
+    async def _remote_put(self, key: str, value: Any):
+        try:
+            await self.db.execute(self.db.table(self.table).upsert({'key': key, 'value': json.dumps(value)}))
+        except Exception as e:
+            print(f"Error writing content cache to Supabase: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        hits = self.memory_hits + self.disk_hits + self.remote_hits
+        lookups = hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'remote_hits': self.remote_hits,
+            'misses': self.misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'bytes_saved': self.bytes_saved,
+            'memory_entries': len(self._memory),
+            'disk_evicted': self.disk_evicted,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,11 +1,93 @@
+import asyncio
+from typing import Dict, Optional, Set
 
-def update_user_studying_status(message, supabase_client):
-    # Update the user's studying status in the database
-    from supabase import create_client, Client
+from async_db import AsyncDB
 
-    # Update the user's studying status to true
-    response = supabase_client.table("users").update({
-                        "studying" : true
-                    }).eq(
-                        "id", message.author.id
-                        ).execute()
\ No newline at end of file
+
+class StudyingStatusUpdater:
+    # Collects studying-status changes for `window` seconds and writes them as one
+    # bulk upsert. A user flipping on and off inside a window only costs their final
+    # state, and `studying` is the local view so nobody has to query it back.
+
+    def __init__(self, db: AsyncDB, table: str = "users", window: float = 2.0):
+        self.db = db
+        self.table = table
+        self.window = window
+        self.studying: Set[int] = set()
+        self._pending: Dict[int, bool] = {}
+        self._flushed: Dict[int, bool] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+        self.flushes = 0
+        self.collapsed = 0
+
+    def set(self, user_id: int, studying: bool):
+        if studying:
+            self.studying.add(user_id)
+        else:
+            self.studying.discard(user_id)
+
+        if user_id in self._pending:
+            self.collapsed += 1
+        self._pending[user_id] = studying
+        self._schedule()
+
+    def _schedule(self):
+        # The running flush counts as scheduled, it checks _pending again once it's done
+        if self._closed:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    def is_studying(self, user_id: int) -> bool:
+        return user_id in self.studying
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        await self.flush()
+        # Changes that came in while the upsert was running, set() saw this task still
+        # alive and left them to us
+        if self._pending:
+            self._task = None
+            self._schedule()
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        # Flipped and flipped back since the last write, nothing to do
+        rows = [
+            {"id": user_id, "studying": studying}
+            for user_id, studying in pending.items()
+            if self._flushed.get(user_id) != studying
+        ]
+        if not rows:
+            return
+
+        try:
+            await self.db.execute(self.db.table(self.table).upsert(rows, on_conflict="id"))
+            self.flushes += 1
+        except Exception as e:
+            print(f"Error updating studying status: {e}")
+            # Keep anything newer that came in while we were writing
+            for user_id, studying in pending.items():
+                self._pending.setdefault(user_id, studying)
+            return
+
+        for row in rows:
+            if row["studying"]:
+                self._flushed[row["id"]] = True
+            else:
+                # Only studying users are remembered, keeps this as small as the studying set
+                self._flushed.pop(row["id"], None)
+
+    async def close(self):
+        self._closed = True
+        if self._task and not self._task.done():
+            self._task.cancel()
+        self._task = None
+        await self.flush()
+
+
+def update_user_studying_status(message, updater: StudyingStatusUpdater, studying: bool = True):
+    # Update the user's studying status, written in bulk with everyone else's
+    updater.set(message.author.id, studying)
@@ -0,0 +1,249 @@
+import asyncio
+import hashlib
+import os
+import random
+from typing import AsyncIterator, Dict, Optional
+
+
+class GeminiError(Exception):
+    pass
+
+
+def create_model():
+    ## google.generativeai takes a second or more to import, it only happens on first use
+    import google.generativeai as genai
+
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    return genai.GenerativeModel(os.getenv("GEMINI_MODEL", "gemini-1.5-flash"))
+
+
+class GeminiGateway:
+    ## owns the gemini model, every prompt the bot sends goes through generate().
+    ## - global + per-guild semaphores so one server can't eat all the slots
+    ## - one deadline per request, shared by all of its retries, starting once it has a slot
+    ## - identical prompts already in flight share a single api call
+
+    def __init__(self, model=None, max_concurrency: int = 8, per_guild_concurrency: int = 2,
+                 timeout: float = 45.0, max_retries: int = 3, base_delay: float = 1.0):
+        self.model = model
+        self._model_lock = asyncio.Lock()
+
+        self.per_guild_concurrency = per_guild_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._guild_slots: Dict[int, asyncio.Semaphore] = {}
+        self._guild_users: Dict[int, int] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._streams: Dict[str, "_StreamFanout"] = {}
+
+        self.requests = 0
+        self.api_calls = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.failures = 0
+
+    async def warm(self):
+        ## builds the default model on a worker thread, the first request (or the
+        ## warm-up after on_ready) waits for it, everyone after that finds it ready
+        async with self._model_lock:
+            if self.model is None:
+                self.model = await asyncio.to_thread(create_model)
+        return self.model
+
+    async def generate(self, prompt: str, guild_id: Optional[int] = None, timeout: Optional[float] = None) -> str:
+        self.requests += 1
+        key = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.get_running_loop().create_task(self._generate(prompt, guild_id, timeout or self.timeout))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        ## shield so one caller giving up doesn't cancel the call for everyone sharing it
+        return await asyncio.shield(task)
+
+    async def _generate(self, prompt: str, guild_id: Optional[int], timeout: float) -> str:
+        loop = asyncio.get_running_loop()
+
+        async with self._guild_slot(guild_id), self._slots:
+            ## time spent queueing for a slot doesn't count against the request
+            deadline = loop.time() + timeout
+            for attempt in range(self.max_retries + 1):
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+
+                try:
+                    self.api_calls += 1
+                    model = self.model or await self.warm()
+                    response = await asyncio.wait_for(model.generate_content_async(prompt), remaining)
+                    return response.text
+                except Exception as e:
+                    print(f"Gemini attempt {attempt + 1} failed: {e}")
+
+                if attempt < self.max_retries:
+                    ## full jitter backoff, never sleeping past the deadline
+                    delay = random.uniform(0, self.base_delay * (2 ** attempt))
+                    delay = min(delay, deadline - loop.time())
+                    if delay <= 0:
+                        break
+                    self.retries += 1
+                    await asyncio.sleep(delay)
+
+        self.failures += 1
+        raise GeminiError("Gemini request failed or timed out")
+
+    async def stream(self, prompt: str, guild_id: Optional[int] = None, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        ## yields the response text as it arrives, same slots and deadline as generate().
+        ## identical prompts in flight share one stream (late joiners get the chunks so
+        ## far replayed), and a caller that stops reading doesn't end it for the others
+        self.requests += 1
+        key = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+        fanout = self._streams.get(key)
+        if fanout is not None:
+            self.coalesced += 1
+        else:
+            fanout = self._streams[key] = _StreamFanout()
+            task = asyncio.get_running_loop().create_task(self._stream(prompt, guild_id, timeout or self.timeout, fanout))
+            task.add_done_callback(lambda _: self._streams.pop(key, None))
+
+        async for text in fanout.follow():
+            yield text
+
+    async def _stream(self, prompt: str, guild_id: Optional[int], timeout: float, fanout: "_StreamFanout"):
+        ## retries only happen before the first chunk, once text went out a failure
+        ## ends the stream with GeminiError
+        loop = asyncio.get_running_loop()
+
+        try:
+            async with self._guild_slot(guild_id), self._slots:
+                deadline = loop.time() + timeout
+                for attempt in range(self.max_retries + 1):
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+
+                    try:
+                        self.api_calls += 1
+                        model = self.model or await self.warm()
+                        ## one timeout for the whole response instead of a wait_for per chunk
+                        async with asyncio.timeout_at(deadline):
+                            response = await model.generate_content_async(prompt, stream=True)
+                            async for chunk in response:
+                                fanout.push(chunk.text)
+                        fanout.finish()
+                        return
+                    except Exception as e:
+                        if fanout.chunks:
+                            raise GeminiError(f"Gemini stream broke off: {e!r}") from e
+                        print(f"Gemini stream attempt {attempt + 1} failed: {e!r}")
+
+                    if attempt < self.max_retries:
+                        delay = random.uniform(0, self.base_delay * (2 ** attempt))
+                        delay = min(delay, deadline - loop.time())
+                        if delay <= 0:
+                            break
+                        self.retries += 1
+                        await asyncio.sleep(delay)
+
+            raise GeminiError("Gemini stream failed or timed out")
+        except BaseException as e:
+            self.failures += 1
+            fanout.finish(e if isinstance(e, Exception) else GeminiError("Gemini stream cancelled"))
+            if not isinstance(e, Exception):
+                raise
+
+    def _guild_slot(self, guild_id: Optional[int]):
+        return _GuildSlot(self, guild_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'requests': self.requests,
+            'api_calls': self.api_calls,
+            'coalesced': self.coalesced,
+            'retries': self.retries,
+            'failures': self.failures,
+            'in_flight': len(self._inflight) + len(self._streams),
+        }
+
+
+class _GuildSlot:
+    ## per-guild semaphore that drops itself once nobody in that guild is waiting,
+    ## so thousands of guilds don't leave thousands of idle semaphores behind
+
+    def __init__(self, gateway: GeminiGateway, guild_id: Optional[int]):
+        self.gateway = gateway
+        self.guild_id = guild_id
+        self.semaphore = None
+
+    async def __aenter__(self):
+        if self.guild_id is None:
+            return self
+
+        gateway = self.gateway
+        self.semaphore = gateway._guild_slots.get(self.guild_id)
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(gateway.per_guild_concurrency)
+            gateway._guild_slots[self.guild_id] = self.semaphore
+        gateway._guild_users[self.guild_id] = gateway._guild_users.get(self.guild_id, 0) + 1
+
+        try:
+            await self.semaphore.acquire()
+        except BaseException:
+            self._leave()
+            raise
+        return self
+
+    async def __aexit__(self, *exc):
+        if self.semaphore is not None:
+            self.semaphore.release()
+            self._leave()
+
+    def _leave(self):
+        gateway = self.gateway
+        gateway._guild_users[self.guild_id] -= 1
+        if gateway._guild_users[self.guild_id] == 0:
+            del gateway._guild_users[self.guild_id]
+            del gateway._guild_slots[self.guild_id]
+
+
+class _StreamFanout:
+    ## chunks of one streamed response, for every caller reading it
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error: Optional[Exception] = None
+        self._changed = asyncio.Event()
+
+    def push(self, text: str):
+        self.chunks.append(text)
+        self._wake()
+
+    def finish(self, error: Optional[Exception] = None):
+        self.done = True
+        self.error = error
+        self._wake()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self) -> AsyncIterator[str]:
+        index = 0
+        while True:
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.done:
+                if self.error:
+                    raise self.error
+                return
+            await self._changed.wait()
@@ -0,0 +1,197 @@
+import asyncio
+import codecs
+import io
+import os
+import tempfile
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+
+from metrics import metrics
+from pdf_extract import MAX_PDF_BYTES, ExtractionResult, extract_pdf_text
+
+## extension -> (kind, size limit, content types discord may report for it)
+ALLOWED_TYPES: Dict[str, Tuple[str, int, Tuple[str, ...]]] = {
+    '.pdf': ('pdf', MAX_PDF_BYTES, ('application/pdf',)),
+    '.txt': ('text', 5 * 1024 * 1024, ('text/plain',)),
+    '.md': ('text', 5 * 1024 * 1024, ('text/markdown', 'text/x-markdown', 'text/plain')),
+}
+MAX_ATTACHMENTS = 10
+MAX_TOTAL_BYTES = 60 * 1024 * 1024
+SPOOL_THRESHOLD = 1024 * 1024
+DOWNLOAD_CHUNK = 64 * 1024
+
+
+class AttachmentTooLarge(Exception):
+    pass
+
+
+class Spool:
+    ## download buffer: bytes stay in memory up to `threshold`, past that everything
+    ## moves to a named temp file, which the pdf workers open by path
+
+    def __init__(self, threshold: int = SPOOL_THRESHOLD, suffix: str = ""):
+        self.threshold = threshold
+        self.suffix = suffix
+        self.size = 0
+        self._buffer: Optional[io.BytesIO] = io.BytesIO()
+        self._file = None
+
+    @property
+    def spooled(self) -> bool:
+        return self._file is not None
+
+    def write(self, chunk: bytes):
+        if self._file is None and self.size + len(chunk) > self.threshold:
+            self._file = tempfile.NamedTemporaryFile(prefix="studybuddy-", suffix=self.suffix, delete=False)
+            self._file.write(self._buffer.getvalue())
+            self._buffer = None
+        (self._file or self._buffer).write(chunk)
+        self.size += len(chunk)
+
+    def source(self) -> Union[bytes, str]:
+        if self._file is not None:
+            self._file.flush()
+            return self._file.name
+        return self._buffer.getvalue()
+
+    def read_text(self) -> str:
+        ## decoded in slices, a spooled file is never read back as one bytes object
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        if self._file is None:
+            return decoder.decode(self._buffer.getvalue(), final=True)
+        self._file.flush()
+        parts = []
+        with open(self._file.name, 'rb') as handle:
+            for chunk in iter(lambda: handle.read(DOWNLOAD_CHUNK), b""):
+                parts.append(decoder.decode(chunk))
+        parts.append(decoder.decode(b"", final=True))
+        return "".join(parts)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            try:
+                os.unlink(self._file.name)
+            except OSError:
+                pass
+            self._file = None
+        self._buffer = None
+
+
+class AttachmentIngestor:
+    ## turns a message's attachments into extracted documents:
+    ## - type and size are checked against ALLOWED_TYPES before anything is downloaded
+    ## - downloads run concurrently (bounded) and stream into a Spool
+    ## - results come out one document at a time, in attachment order, as they finish
+
+    def __init__(self, max_concurrency: int = 4, spool_threshold: int = SPOOL_THRESHOLD,
+                 max_attachments: int = MAX_ATTACHMENTS, max_total_bytes: int = MAX_TOTAL_BYTES,
+                 timeout: float = 60.0):
+        self.spool_threshold = spool_threshold
+        self.max_attachments = max_attachments
+        self.max_total_bytes = max_total_bytes
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._session = None
+
+        self.downloaded_bytes = 0
+        self.spooled = 0
+        self.rejected = 0
+
+    def check(self, attachment) -> Optional[str]:
+        ## reason to skip the attachment, None if it may be downloaded
+        extension = os.path.splitext(attachment.filename.lower())[1]
+        allowed = ALLOWED_TYPES.get(extension)
+        if allowed is None:
+            return "unsupported file type, use .pdf, .txt or .md"
+
+        _, limit, content_types = allowed
+        content_type = (getattr(attachment, 'content_type', None) or "").split(';')[0].strip()
+        if content_type and content_type != 'application/octet-stream' and content_type not in content_types:
+            return f"content type {content_type} doesn't match the {extension} extension"
+        if attachment.size > limit:
+            return f"file is larger than {limit // (1024 * 1024)} MB"
+        return None
+
+    async def ingest(self, attachments: List) -> AsyncIterator[Tuple[str, ExtractionResult]]:
+        budget = self.max_total_bytes
+        jobs = []
+        for index, attachment in enumerate(attachments):
+            reason = self.check(attachment)
+            if reason is None and index >= self.max_attachments:
+                reason = f"only the first {self.max_attachments} attachments are used"
+            if reason is None and attachment.size > budget:
+                reason = f"all attachments together are limited to {self.max_total_bytes // (1024 * 1024)} MB"
+            if reason is not None:
+                self.rejected += 1
+                jobs.append((attachment.filename, ExtractionResult(reason=reason)))
+                continue
+            budget -= attachment.size
+            jobs.append((attachment.filename, asyncio.create_task(self._process(attachment))))
+
+        try:
+            for filename, job in jobs:
+                yield filename, (job if isinstance(job, ExtractionResult) else await job)
+        finally:
+            ## the caller stopped early (session cancelled...), don't leave downloads running
+            for _, job in jobs:
+                if isinstance(job, asyncio.Task):
+                    job.cancel()
+
+    async def _process(self, attachment) -> ExtractionResult:
+        extension = os.path.splitext(attachment.filename.lower())[1]
+        kind, limit, _ = ALLOWED_TYPES[extension]
+        spool = Spool(self.spool_threshold, suffix=extension)
+        try:
+            async with self._slots:
+                with metrics.span("discord.attachment_download"):
+                    await asyncio.wait_for(self._download(attachment, spool, limit), self.timeout)
+            self.downloaded_bytes += spool.size
+            self.spooled += spool.spooled
+
+            if kind == 'pdf':
+                with metrics.span("extract.pdf"):
+                    return await extract_pdf_text(spool.source())
+            with metrics.span("extract.text"):
+                text = await asyncio.to_thread(spool.read_text)
+            return ExtractionResult(text, 1, 1)
+        except AttachmentTooLarge:
+            return ExtractionResult(reason=f"file is larger than {limit // (1024 * 1024)} MB")
+        except asyncio.TimeoutError:
+            return ExtractionResult(reason=f"download took longer than {self.timeout:.0f}s")
+        except Exception as e:
+            print(f"Error downloading attachment {attachment.filename}: {e}")
+            return ExtractionResult(reason="download failed")
+        finally:
+            spool.close()
+
+    async def _download(self, attachment, spool: Spool, limit: int):
+        url = getattr(attachment, 'url', None)
+        if not url:
+            ## anything without a cdn url (tests, fakes) is read in one go
+            spool.write(await attachment.read())
+            return
+
+        async with self._get_session().get(url) as response:
+            response.raise_for_status()
+            ## attachment.size comes from discord, the stream is checked as well
+            async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK):
+                if spool.size + len(chunk) > limit:
+                    raise AttachmentTooLarge()
+                spool.write(chunk)
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            import aiohttp
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'downloaded_bytes': self.downloaded_bytes,
+            'spooled': self.spooled,
+            'rejected': self.rejected,
+        }
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
@@ -0,0 +1,269 @@
+## in-process stand-ins for discord, gemini and supabase, used by bench_load.py.
+## latencies are in virtual seconds, see VirtualClockLoop
+
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    ## loop.time() runs `speed` times faster than the wall clock and the selector
+    ## waits are shrunk to match, so asyncio.sleep(25 * 60) takes 25*60/speed real
+    ## seconds while everything that reads loop.time() still sees 25 minutes
+
+    def __init__(self, speed: float):
+        super().__init__()
+        self.speed = speed
+        self._origin = time.monotonic()
+        self._selector = _ScaledSelector(self._selector, speed)
+
+    def time(self):
+        return self._origin + (time.monotonic() - self._origin) * self.speed
+
+
+class _ScaledSelector:
+    def __init__(self, selector, speed: float):
+        self._selector = selector
+        self._speed = speed
+
+    def select(self, timeout=None):
+        return self._selector.select(None if timeout is None else timeout / self._speed)
+
+    def __getattr__(self, name):
+        return getattr(self._selector, name)
+
+
+class ApiCounter:
+    def __init__(self):
+        self.calls = Counter()
+
+    def hit(self, name: str):
+        self.calls[name] += 1
+
+
+## --- supabase ---
+
+class FakeQuery:
+    def __init__(self, client: "FakeSupabase", table: str):
+        self.client = client
+        self.table = table
+        self.operation = 'select'
+        self.payload = None
+
+    def _op(self, operation: str, payload=None, **kwargs):
+        self.operation = operation
+        self.payload = payload
+        return self
+
+    def select(self, *args, **kwargs):
+        return self._op('select')
+
+    def insert(self, payload, **kwargs):
+        return self._op('insert', payload)
+
+    def update(self, payload, **kwargs):
+        return self._op('update', payload)
+
+    def upsert(self, payload, **kwargs):
+        return self._op('upsert', payload)
+
+    def delete(self, **kwargs):
+        return self._op('delete')
+
+    @property
+    def http_method(self):
+        return {'select': 'GET', 'insert': 'POST', 'upsert': 'POST', 'update': 'PATCH', 'delete': 'DELETE'}[self.operation]
+
+    def eq(self, *args):
+        return self
+
+    def in_(self, *args):
+        return self
+
+    def execute(self):
+        ## runs on the AsyncDB worker threads, so this is a real (scaled) blocking sleep
+        self.client.counter.hit(f"supabase.{self.table}.{self.operation}")
+        time.sleep(self.client.latency() / self.client.speed)
+        if self.operation == 'select':
+            return SimpleNamespace(data=[])
+        rows = self.payload if isinstance(self.payload, list) else [self.payload]
+        return SimpleNamespace(data=[row for row in rows if row is not None])
+
+
+class FakeSupabase:
+    def __init__(self, counter: ApiCounter, speed: float, latency: float = 0.05, jitter: float = 0.03):
+        self.counter = counter
+        self.speed = speed
+        self._latency = latency
+        self._jitter = jitter
+
+    def latency(self) -> float:
+        return max(0.0, random.gauss(self._latency, self._jitter))
+
+    def table(self, name: str):
+        return FakeQuery(self, name)
+
+
+## --- gemini ---
+
+class FakeGeminiModel:
+    def __init__(self, counter: ApiCounter, latency: float = 3.0, jitter: float = 1.0):
+        self.counter = counter
+        self._latency = latency
+        self._jitter = jitter
+        self._questions = itertools.count()
+
+    async def generate_content_async(self, prompt: str, stream: bool = False):
+        self.counter.hit("gemini.generate")
+        latency = max(0.1, random.gauss(self._latency, self._jitter))
+        if stream:
+            ## first chunk after a fraction of the full latency, the rest trickles in
+            await asyncio.sleep(latency * 0.15)
+            return self._stream(latency * 0.85)
+        await asyncio.sleep(latency)
+
+        if "Quiz Designer" in prompt:
+            quiz = []
+            for _ in range(3):
+                number = next(self._questions)
+                quiz.append({
+                    "question": f"Synthetic question {number}?",
+                    "options": {"A": "one", "B": "two", "C": "three", "D": "four"},
+                    "correct_answer": random.choice("ABCD"),
+                })
+            return SimpleNamespace(text=json.dumps(quiz))
+
+        return SimpleNamespace(text="\n".join(f"- Key point {i} about the material." for i in range(6)))
+
+    async def _stream(self, latency: float):
+        for i in range(6):
+            yield SimpleNamespace(text=f"- Key point {i} about the material.\n")
+            await asyncio.sleep(latency / 6)
+
+
+## --- discord ---
+
+class FakeMessage:
+    def __init__(self, channel: "FakeTextChannel"):
+        self.channel = channel
+
+    async def edit(self, **kwargs):
+        await self.channel._api("discord.edit")
+        return self
+
+
+class FakeTextChannel:
+    _ids = itertools.count(1)
+
+    def __init__(self, harness: "FakeDiscord", guild, name: str = "general"):
+        self.harness = harness
+        self.guild = guild
+        self.name = name
+        self.id = next(self._ids)
+
+    async def _api(self, name: str):
+        self.harness.counter.hit(name)
+        await asyncio.sleep(max(0.0, random.gauss(self.harness.latency, self.harness.latency / 3)))
+
+    async def send(self, content=None, *, embed=None, view=None, **kwargs):
+        await self._api("discord.send")
+        if view is not None:
+            self.harness.answer_later(view)
+        return FakeMessage(self)
+
+
+class FakeVoiceChannel:
+    _ids = itertools.count(10 ** 6)
+
+    def __init__(self, guild, name: str):
+        self.guild = guild
+        self.name = name
+        self.id = next(self._ids)
+
+
+class FakeGuild:
+    def __init__(self, harness: "FakeDiscord", guild_id: int):
+        self.id = guild_id
+        self.study_channel = FakeVoiceChannel(self, "study-vc")
+        self.lounge = FakeVoiceChannel(self, "lounge")
+        self.voice_channels = [self.lounge, self.study_channel]
+        self.text_channels = [FakeTextChannel(harness, self, "general")]
+        self.members: Dict[int, "FakeMember"] = {}
+
+    def get_channel(self, channel_id: int):
+        for channel in self.voice_channels + self.text_channels:
+            if channel.id == channel_id:
+                return channel
+        return None
+
+    def get_member(self, user_id: int):
+        return self.members.get(user_id)
+
+
+class FakeMember:
+    def __init__(self, user_id: int, guild: FakeGuild):
+        self.id = user_id
+        self.guild = guild
+        self.mention = f"<@{user_id}>"
+        self.voice = SimpleNamespace(channel=guild.lounge)
+        guild.members[user_id] = self
+
+    async def move_to(self, channel):
+        self.voice.channel = channel
+
+
+class FakeContext:
+    def __init__(self, member: FakeMember, channel: FakeTextChannel):
+        self.author = member
+        self.guild = member.guild
+        self.channel = channel
+        self.message = SimpleNamespace(attachments=[])
+
+    async def send(self, *args, **kwargs):
+        return await self.channel.send(*args, **kwargs)
+
+
+class FakeDiscord:
+    def __init__(self, counter: ApiCounter, guilds: int, latency: float = 0.1, answer_delay: float = 10.0):
+        self.counter = counter
+        self.latency = latency
+        self.answer_delay = answer_delay
+        self.guilds = [FakeGuild(self, guild_id) for guild_id in range(1, guilds + 1)]
+        self._pending = set()
+
+    def answer_later(self, view):
+        ## a user working through the quiz, one click every so often within answer_delay
+        async def answer():
+            ## a group quiz is answered by every participant on the same message
+            participants = getattr(view, 'participants', None)
+            for index in range(len(view.questions)):
+                await asyncio.sleep(random.uniform(1.0, self.answer_delay))
+                if participants is None:
+                    self.counter.hit("discord.interaction")
+                    view.answer(index, random.choice("ABCD"))
+                    continue
+                for user_id in list(participants):
+                    self.counter.hit("discord.interaction")
+                    view.answer_for(user_id, index, random.choice("ABCD"))
+            view.stop()
+
+        task = asyncio.get_running_loop().create_task(answer())
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    def member(self, user_id: int) -> FakeMember:
+        guild = self.guilds[user_id % len(self.guilds)]
+        return guild.members.get(user_id) or FakeMember(user_id, guild)
+
+    def context(self, member: FakeMember) -> FakeContext:
+        return FakeContext(member, member.guild.text_channels[0])
+
+    def voice_event(self, member: FakeMember, channel: Optional[FakeVoiceChannel]):
+        before = SimpleNamespace(channel=member.voice.channel)
+        member.voice.channel = channel
+        return member, before, SimpleNamespace(channel=channel)
@@ -0,0 +1,186 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  ## last one is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class Metrics:
+    ## counters, latency histograms and gauges for the hot paths, rendered in the
+    ## prometheus text format. spans are plain `with` blocks so they work the same
+    ## around sync code and awaits
+
+    def __init__(self, prefix: str = "studybuddy"):
+        self.prefix = prefix
+        self.counters: Dict[Tuple[str, str], float] = Counter()
+        self.histograms: Dict[str, Histogram] = {}
+        self.gauges: Dict[str, Callable[[], float]] = {}
+
+    def inc(self, name: str, value: float = 1, label: str = ""):
+        self.counters[(name, label)] += value
+
+    def observe(self, span: str, seconds: float):
+        histogram = self.histograms.get(span)
+        if histogram is None:
+            histogram = self.histograms[span] = Histogram()
+        histogram.observe(seconds)
+
+    def gauge(self, name: str, read: Callable[[], float]):
+        self.gauges[name] = read
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            if not isinstance(e, asyncio.CancelledError):
+                self.inc("span_errors_total", label=name)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def render(self) -> str:
+        prefix = self.prefix
+        lines = [f"# TYPE {prefix}_span_seconds histogram"]
+        for span, histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets_with_inf(histogram), histogram.counts):
+                cumulative += count
+                lines.append(f'{prefix}_span_seconds_bucket{{span="{span}",le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_span_seconds_sum{{span="{span}"}} {histogram.total:.6f}')
+            lines.append(f'{prefix}_span_seconds_count{{span="{span}"}} {histogram.count}')
+
+        names = sorted({name for name, _ in self.counters})
+        for name in names:
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            for (counter, label), value in sorted(self.counters.items()):
+                if counter == name:
+                    labels = f'{{span="{label}"}}' if label else ""
+                    lines.append(f"{prefix}_{name}{labels} {value:g}")
+
+        for name, read in sorted(self.gauges.items()):
+            try:
+                value = float(read())
+            except Exception:
+                continue
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {value:g}")
+
+        return "\n".join(lines) + "\n"
+
+    def buckets_with_inf(self, histogram: Histogram) -> List[str]:
+        return [f"{bound:g}" for bound in histogram.buckets] + ["+Inf"]
+
+
+class LoopProfiler:
+    ## opt-in sampling profiler: a watchdog thread notices when the loop has not
+    ## ticked for `threshold` seconds and records the loop thread's current stack,
+    ## so /profile shows what was blocking it
+
+    def __init__(self, threshold: float = 0.1, interval: float = 0.01, depth: int = 12):
+        self.threshold = threshold
+        self.interval = interval
+        self.depth = depth
+        self.samples: Counter = Counter()
+        self._last_beat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._stopped = threading.Event()
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self._loop_thread = threading.get_ident()
+        self._beat(loop)
+        threading.Thread(target=self._watch, name="loop-profiler", daemon=True).start()
+
+    def _beat(self, loop):
+        self._last_beat = time.monotonic()
+        if not self._stopped.is_set():
+            loop.call_later(self.interval, self._beat, loop)
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            if time.monotonic() - self._last_beat < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame, limit=self.depth)
+            self.samples["\n".join(f"  {entry.filename}:{entry.lineno} {entry.name}" for entry in stack)] += 1
+
+    def render(self, top: int = 20) -> str:
+        out = []
+        for stack, count in self.samples.most_common(top):
+            out.append(f"{count} samples\n{stack}\n")
+        return "\n".join(out) or "no stalls sampled\n"
+
+    def stop(self):
+        self._stopped.set()
+
+
+metrics = Metrics()
+
+
+async def serve_metrics(port: int, host: str = "127.0.0.1", profiler: Optional[LoopProfiler] = None):
+    ## tiny http server: GET /metrics (and /profile when profiling), local only by default
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+
+            path = request_line.decode("latin-1").split(" ")[1] if request_line.count(b" ") >= 2 else "/"
+            if path.startswith("/metrics"):
+                status, body = "200 OK", metrics.render()
+            elif path.startswith("/profile") and profiler is not None:
+                status, body = "200 OK", profiler.render()
+            else:
+                status, body = "404 Not Found", "not found\n"
+
+            payload = body.encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode("latin-1") + payload
+            )
+            await writer.drain()
+        except Exception:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+async def dump_metrics(path: str, interval: float = 60.0):
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(_write_file, path, metrics.render())
+    except asyncio.CancelledError:
+        pass
+
+
+def _write_file(path: str, text: str):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as out:
+        out.write(text)
+    os.replace(tmp, path)
@@ -0,0 +1,202 @@
+import asyncio
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from content_cache import normalize_content
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS  ## 16 bands of 4 rows: pairs above ~0.5 jaccard become candidates
+SHINGLE_WORDS = 5
+## only shingles whose hash is 0 mod this are kept, the same ones for every document,
+## so the jaccard estimate holds and big uploads cost a quarter of the hashing
+SAMPLE_MOD = 4
+MIN_SHINGLES = 8
+
+_PRIME = (1 << 61) - 1
+_MASK = 0xFFFFFFFF
+_random = random.Random(0x5EED)
+_PERMUTATIONS = [(_random.randrange(1, _PRIME), _random.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+_WORD = re.compile(r"\w+")
+
+
+def shingles(text: str) -> Set[int]:
+    words = _WORD.findall(normalize_content(text).lower())
+    hashes = set()
+    for i in range(len(words) - SHINGLE_WORDS + 1):
+        h = zlib.crc32(" ".join(words[i:i + SHINGLE_WORDS]).encode('utf-8'))
+        if h % SAMPLE_MOD == 0:
+            hashes.add(h)
+    return hashes
+
+
+def minhash(text: str) -> Optional[array]:
+    ## None for material too short to say anything about, the exact cache covers those
+    hashes = shingles(text)
+    if len(hashes) < MIN_SHINGLES:
+        return None
+    return array('I', [min(((a * h + b) % _PRIME) & _MASK for h in hashes) for a, b in _PERMUTATIONS])
+
+
+def similarity(left: array, right: array) -> float:
+    return sum(1 for x, y in zip(left, right) if x == y) / NUM_PERM
+
+
+def _bands(signature: array) -> List[Tuple[int, Tuple[int, ...]]]:
+    return [(band, tuple(signature[band * ROWS:(band + 1) * ROWS])) for band in range(BANDS)]
+
+
+class _GuildIndex:
+    def __init__(self):
+        self.docs: "OrderedDict[int, Tuple[array, List[str]]]" = OrderedDict()  ## doc_id -> (signature, bullet points)
+        self.buckets: Dict[Tuple[int, Tuple[int, ...]], Set[int]] = {}
+
+    def add(self, doc_id: int, signature: array, bullet_points: List[str]):
+        self.docs[doc_id] = (signature, bullet_points)
+        for band in _bands(signature):
+            self.buckets.setdefault(band, set()).add(doc_id)
+
+    def remove(self, doc_id: int):
+        signature, _ = self.docs.pop(doc_id)
+        for band in _bands(signature):
+            bucket = self.buckets.get(band)
+            if bucket:
+                bucket.discard(doc_id)
+                if not bucket:
+                    del self.buckets[band]
+
+    def best(self, signature: array) -> Tuple[Optional[int], float]:
+        candidates = set()
+        for band in _bands(signature):
+            candidates.update(self.buckets.get(band, ()))
+
+        best_id, best_score = None, 0.0
+        for doc_id in candidates:
+            score = similarity(signature, self.docs[doc_id][0])
+            if score > best_score:
+                best_id, best_score = doc_id, score
+        return best_id, best_score
+
+
+class NearDuplicateIndex:
+    ## minhash/lsh over analyzed study material, per guild. a new upload that is
+    ## `threshold` similar to one analyzed before (other filename, other footer...)
+    ## gets that one's bullet points, and with the same points the quiz cache hits too.
+    ## signatures are 256 bytes each, kept in a local sqlite file and loaded per guild
+
+    def __init__(self, path: Optional[str] = None, threshold: float = 0.8, prompt_version: int = 1,
+                 max_docs_per_guild: int = 500, max_guilds: int = 1000):
+        self.path = path or os.getenv("STUDYBUDDY_NEAR_DUP_PATH", "near_duplicates.sqlite3")
+        self.threshold = threshold
+        self.prompt_version = prompt_version
+        self.max_docs_per_guild = max_docs_per_guild
+        self.max_guilds = max_guilds
+
+        self._guilds: "OrderedDict[int, _GuildIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS near_duplicates ("
+            " doc_id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER NOT NULL,"
+            " prompt_version INTEGER NOT NULL, signature BLOB NOT NULL,"
+            " bullet_points TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS near_duplicates_guild ON near_duplicates (guild_id, prompt_version)")
+        self._conn.commit()
+
+        self.hits = 0
+        self.misses = 0
+
+    async def signature(self, text: str) -> Optional[array]:
+        ## hashing a big upload takes a few ms, keep it off the loop
+        return await asyncio.to_thread(minhash, text)
+
+    async def find(self, guild_id: int, signature: Optional[array]) -> Optional[List[str]]:
+        if signature is None:
+            return None
+        index = await self._guild(guild_id)
+        doc_id, score = index.best(signature)
+        if doc_id is None or score < self.threshold:
+            self.misses += 1
+            return None
+        self.hits += 1
+        index.docs.move_to_end(doc_id)
+        return index.docs[doc_id][1]
+
+    async def add(self, guild_id: int, signature: Optional[array], bullet_points: List[str]):
+        if signature is None:
+            return
+        index = await self._guild(guild_id)
+        doc_id = await asyncio.to_thread(self._disk_put, guild_id, signature, bullet_points)
+        index.add(doc_id, signature, bullet_points)
+
+        while len(index.docs) > self.max_docs_per_guild:
+            oldest = next(iter(index.docs))
+            index.remove(oldest)
+            await asyncio.to_thread(self._disk_delete, oldest)
+
+    async def _guild(self, guild_id: int) -> _GuildIndex:
+        index = self._guilds.get(guild_id)
+        if index is None:
+            index = _GuildIndex()
+            for doc_id, signature, bullet_points in await asyncio.to_thread(self._disk_load, guild_id):
+                index.add(doc_id, signature, bullet_points)
+            ## another caller may have loaded it meanwhile
+            index = self._guilds.setdefault(guild_id, index)
+        self._guilds.move_to_end(guild_id)
+        while len(self._guilds) > self.max_guilds:
+            self._guilds.popitem(last=False)
+        return index
+
+    def _disk_load(self, guild_id: int) -> List[Tuple[int, array, List[str]]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT doc_id, signature, bullet_points FROM near_duplicates"
+                " WHERE guild_id = ? AND prompt_version = ? ORDER BY doc_id DESC LIMIT ?",
+                (guild_id, self.prompt_version, self.max_docs_per_guild)
+            ).fetchall()
+        loaded = []
+        for doc_id, blob, bullet_points in reversed(rows):
+            signature = array('I')
+            signature.frombytes(blob)
+            loaded.append((doc_id, signature, json.loads(bullet_points)))
+        return loaded
+
+    def _disk_put(self, guild_id: int, signature: array, bullet_points: List[str]) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO near_duplicates (guild_id, prompt_version, signature, bullet_points, created_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (guild_id, self.prompt_version, signature.tobytes(), json.dumps(bullet_points), time.time())
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def _disk_delete(self, doc_id: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM near_duplicates WHERE doc_id = ?", (doc_id,))
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'guilds_loaded': len(self._guilds),
+            'docs_loaded': sum(len(index.docs) for index in self._guilds.values()),
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,175 @@
+import asyncio
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple, Union
+
+MAX_PDF_BYTES = 25 * 1024 * 1024
+MAX_PDF_PAGES = 300
+EXTRACT_TIMEOUT = 20.0
+PAGES_PER_TASK = 20
+POOL_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+class ExtractionResult:
+    def __init__(self, text: str = "", pages_total: int = 0, pages_processed: int = 0, reason: Optional[str] = None):
+        self.text = text
+        self.pages_total = pages_total
+        self.pages_processed = pages_processed
+        self.reason = reason  ## set when we stopped early or got nothing usable
+
+    @property
+    def partial(self) -> bool:
+        return self.reason is not None
+
+    def describe(self) -> str:
+        if not self.partial:
+            return f"{self.pages_processed} pages"
+        if not self.pages_total:
+            return f"skipped ({self.reason})"
+        return f"partially processed, {self.pages_processed}/{self.pages_total} pages ({self.reason})"
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        ## spawn like the shard processes: forking the bot would copy its event loop,
+        ## sockets and the gemini client's threads into every worker
+        _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _recycle_pool(pool: ProcessPoolExecutor):
+    ## a worker stuck inside one page can't be cancelled, and a few of those would block
+    ## every later upload. the pool is replaced and its processes killed, an upload that
+    ## was sharing it only loses the pages it hadn't got back yet
+    global _pool
+    if _pool is pool:
+        _pool = None
+    processes = list((pool._processes or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.kill()
+    print(f"PDF extraction overran its deadline, restarted the worker pool ({len(processes)} workers)")
+
+
+async def warm_pool():
+    ## starts the workers and has each one import PyPDF2 now instead of on the first upload
+    loop = asyncio.get_running_loop()
+    pool = get_pool()
+    await asyncio.gather(*[loop.run_in_executor(pool, _warm_worker) for _ in range(POOL_WORKERS)])
+
+
+## these run inside the worker processes. PyPDF2 is imported on first use, the bot
+## process itself never needs it unless extract_pdf_text_sync is called
+
+def _load_backend():
+    import PyPDF2
+    return PyPDF2
+
+
+def _warm_worker():
+    _load_backend()
+
+
+def _reader(source: Union[bytes, str]):
+    ## a path (spooled upload) is opened by each worker, so big files aren't pickled per task
+    return _load_backend().PdfReader(source if isinstance(source, str) else io.BytesIO(source))
+
+
+def _count_pages(source: Union[bytes, str]) -> int:
+    return len(_reader(source).pages)
+
+
+def _extract_range(source: Union[bytes, str], start: int, end: int, deadline: float) -> Tuple[int, List[str]]:
+    reader = _reader(source)
+    texts = []
+    for index in range(start, end):
+        if time.time() >= deadline:
+            break
+        try:
+            texts.append(reader.pages[index].extract_text() or "")
+        except Exception:
+            texts.append("")
+    return start, texts
+
+
+def extract_pdf_text_sync(data: bytes, max_pages: int = MAX_PDF_PAGES) -> ExtractionResult:
+    ## single process version, kept for the benchmark and for when no pool is wanted
+    reader = _load_backend().PdfReader(io.BytesIO(data))
+    total = len(reader.pages)
+    texts = [page.extract_text() or "" for page in reader.pages[:max_pages]]
+    reason = f"page limit of {max_pages}" if total > max_pages else None
+    return ExtractionResult("\f".join(texts), total, len(texts), reason)
+
+
+async def extract_pdf_text(data: Union[bytes, str], max_bytes: int = MAX_PDF_BYTES, max_pages: int = MAX_PDF_PAGES,
+                           timeout: float = EXTRACT_TIMEOUT, pages_per_task: int = PAGES_PER_TASK) -> ExtractionResult:
+    size = os.path.getsize(data) if isinstance(data, str) else len(data)
+    if size > max_bytes:
+        return ExtractionResult(reason=f"file is larger than {max_bytes // (1024 * 1024)} MB")
+
+    loop = asyncio.get_running_loop()
+    pool = get_pool()
+    deadline = time.time() + timeout
+
+    try:
+        total = await asyncio.wait_for(loop.run_in_executor(pool, _count_pages, data), timeout)
+    except asyncio.TimeoutError:
+        _recycle_pool(pool)
+        return ExtractionResult(reason="timed out opening the PDF")
+    except Exception as e:
+        print(f"Error reading PDF: {e}")
+        return ExtractionResult(reason="could not read the PDF")
+
+    pages = min(total, max_pages)
+    futures = [
+        loop.run_in_executor(pool, _extract_range, data, start, min(start + pages_per_task, pages), deadline)
+        for start in range(0, pages, pages_per_task)
+    ]
+
+    ## workers stop on their own at the deadline, the extra second is for them to report back
+    done, pending = await asyncio.wait(futures, timeout=max(0.0, deadline - time.time()) + 1.0)
+    for future in pending:
+        future.cancel()
+    if pending:
+        ## one of them is stuck on a page, the deadline is only checked in between
+        _recycle_pool(pool)
+
+    ranges = {}
+    for future in done:
+        if future.exception() is None:
+            start, texts = future.result()
+            ranges[start] = texts
+
+    ## keep pages in order and stop at the first gap so the text never skips ahead
+    texts = []
+    for start in range(0, pages, pages_per_task):
+        chunk = ranges.get(start, [])
+        texts.extend(chunk)
+        if len(chunk) < min(pages_per_task, pages - start):
+            break
+
+    reason = None
+    if len(texts) < pages:
+        reason = f"stopped after {timeout:.0f}s"
+    elif total > max_pages:
+        reason = f"page limit of {max_pages}"
+
+    ## form feeds keep the page boundaries, text_cleanup uses them to find headers/footers
+    text = "\f".join(texts)
+    if not text.strip() and pages:
+        reason = "no text layer found, the PDF looks scanned"
+
+    return ExtractionResult(text, total, len(texts), reason)
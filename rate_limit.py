@@ -0,0 +1,127 @@
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+## what a command costs in tokens. analysis pays one unit per CHUNK_TOKEN_BUDGET-sized
+## piece of material on top of the base, quizzes are paid up front for every cycle
+ANALYZE_BASE_COST = 1.0
+QUIZ_COST = 0.5
+
+
+class TokenBucketLimiter:
+    ## one bucket per key, refilled at `rate` tokens/second up to `capacity`.
+    ## a bucket that has been idle long enough to be full again is the same as no
+    ## bucket at all, so those are dropped lazily from the LRU end on every call
+    ## and the map never holds more than `maxsize` keys
+
+    def __init__(self, capacity: float, rate: float, maxsize: int = 50000):
+        self.capacity = capacity
+        self.rate = rate
+        self.maxsize = maxsize
+        self._buckets: "OrderedDict[Hashable, Tuple[float, float]]" = OrderedDict()  ## key -> (tokens, updated_at)
+
+        self.allowed = 0
+        self.rejected = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _tokens(self, key: Hashable, now: float) -> float:
+        entry = self._buckets.get(key)
+        if entry is None:
+            return self.capacity
+        tokens, updated_at = entry
+        return min(self.capacity, tokens + (now - updated_at) * self.rate)
+
+    def wait_time(self, key: Hashable, cost: float, now: Optional[float] = None) -> float:
+        ## seconds until `cost` tokens are available, 0 if they already are. a cost
+        ## above the capacity never fits, callers turn those away before asking
+        if cost > self.capacity:
+            return math.inf
+        now = time.monotonic() if now is None else now
+        missing = cost - self._tokens(key, now)
+        return max(0.0, missing / self.rate)
+
+    def take(self, key: Hashable, cost: float, now: Optional[float] = None):
+        ## unconditional, callers check wait_time first (see acquire)
+        now = time.monotonic() if now is None else now
+        self._buckets[key] = (self._tokens(key, now) - cost, now)
+        self._buckets.move_to_end(key)
+        self._evict(now)
+
+    def _evict(self, now: float):
+        full_after = self.capacity / self.rate
+        while self._buckets:
+            key, (tokens, updated_at) = next(iter(self._buckets.items()))
+            if len(self._buckets) <= self.maxsize and now - updated_at < full_after:
+                break
+            self._buckets.popitem(last=False)
+            self.evicted += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'buckets': len(self._buckets),
+            'allowed': self.allowed,
+            'rejected': self.rejected,
+            'evicted': self.evicted,
+        }
+
+
+class SharedTokenBucket:
+    ## the same bucket kept in the SharedStateBackend, so every shard process draws
+    ## from one budget per key. used for users: their guilds can sit on different
+    ## processes, a guild only ever lives on one and keeps a TokenBucketLimiter
+
+    def __init__(self, backend, namespace: str, capacity: float, rate: float):
+        self.backend = backend
+        self.namespace = namespace
+        self.capacity = capacity
+        self.rate = rate
+
+        self.allowed = 0
+        self.rejected = 0
+
+    async def wait_time(self, key: Hashable, cost: float) -> float:
+        return await self.backend.take_tokens(f"{self.namespace}:{key}", cost, self.capacity, self.rate, dry_run=True)
+
+    async def try_take(self, key: Hashable, cost: float) -> float:
+        ## atomic on the backend, 0 if taken or how long to wait
+        wait = await self.backend.take_tokens(f"{self.namespace}:{key}", cost, self.capacity, self.rate)
+        if wait > 0:
+            self.rejected += 1
+        else:
+            self.allowed += 1
+        return wait
+
+    def stats(self) -> Dict[str, int]:
+        return {'allowed': self.allowed, 'rejected': self.rejected}
+
+
+async def acquire(checks: List[Tuple[TokenBucketLimiter, Hashable]], cost: float,
+                  shared: Optional[Tuple[SharedTokenBucket, Hashable]] = None) -> float:
+    ## all-or-nothing over several buckets (user + guild): nothing is taken unless
+    ## every bucket can pay, returns 0 on success or how long to wait. the shared
+    ## bucket is charged last, once the local ones are known to have room
+    now = time.monotonic()
+    wait = max(limiter.wait_time(key, cost, now) for limiter, key in checks)
+    if wait == 0 and shared is not None:
+        wait = await shared[0].try_take(shared[1], cost)
+    for limiter, key in checks:
+        if wait > 0:
+            limiter.rejected += 1
+        else:
+            ## can overdraw by whatever another command took during the backend call,
+            ## the local bucket then just refills a little later
+            limiter.take(key, cost)
+            limiter.allowed += 1
+    return wait
+
+
+def format_wait(seconds: float) -> str:
+    seconds = int(seconds + 0.999)
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes, seconds = divmod(seconds, 60)
+    return f"{minutes}m {seconds:02d}s" if seconds else f"{minutes}m"
@@ -0,0 +1,305 @@
+import argparse
+import asyncio
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+## table -> key columns, every table is upserted on its key
+TOTALS_TABLE = 'study_user_totals'
+DAILY_TABLE = 'study_user_daily'
+GUILD_DAILY_TABLE = 'study_guild_daily'
+KEYS = {
+    TOTALS_TABLE: ('guild_id', 'user_id'),
+    DAILY_TABLE: ('guild_id', 'user_id', 'day'),
+    GUILD_DAILY_TABLE: ('guild_id', 'day'),
+}
+COUNTERS = ('minutes', 'cycles', 'sessions', 'quiz_sum', 'quiz_count')
+
+
+def _empty_row(table: str, key: Tuple) -> Dict[str, Any]:
+    row = dict(zip(KEYS[table], key))
+    row.update({counter: 0 for counter in COUNTERS})
+    if table == TOTALS_TABLE:
+        row.update({'current_streak': 0, 'best_streak': 0, 'last_day': None})
+    if table == GUILD_DAILY_TABLE:
+        row['users'] = 0
+    return row
+
+
+def apply_session(rows: Dict[Tuple[str, Tuple], Dict[str, Any]], record: Dict[str, Any]):
+    ## adds one study_sessions record to the three rollup rows it touches. shared by the
+    ## live path and the backfill, `rows` maps (table, key) -> row and must already hold them
+    guild_id, user_id = record['guild_id'], record['user_id']
+    day = session_day(record)
+    delta = {
+        'minutes': float(record.get('duration_minutes') or 0),
+        'cycles': int(record.get('cycles_completed') or 0),
+        'sessions': 1,
+        'quiz_sum': float(record['avg_quiz_score']) if record.get('avg_quiz_score') is not None else 0.0,
+        'quiz_count': 1 if record.get('avg_quiz_score') is not None else 0,
+    }
+
+    daily = rows[(DAILY_TABLE, (guild_id, user_id, day))]
+    guild_daily = rows[(GUILD_DAILY_TABLE, (guild_id, day))]
+    totals = rows[(TOTALS_TABLE, (guild_id, user_id))]
+    if not daily['sessions']:
+        guild_daily['users'] += 1
+    for row in (daily, guild_daily, totals):
+        for counter, value in delta.items():
+            row[counter] += value
+
+    ## streaks only move forward, a late record for an older day doesn't reset them
+    last_day = totals['last_day']
+    if last_day is None or day > last_day:
+        if last_day == (date.fromisoformat(day) - timedelta(days=1)).isoformat():
+            totals['current_streak'] += 1
+        else:
+            totals['current_streak'] = 1
+        totals['best_streak'] = max(totals['best_streak'], totals['current_streak'])
+        totals['last_day'] = day
+
+
+def session_day(record: Dict[str, Any]) -> str:
+    return str(record.get('ended_at') or record.get('started_at'))[:10]
+
+
+def rollup_keys(record: Dict[str, Any]) -> List[Tuple[str, Tuple]]:
+    guild_id, user_id, day = record['guild_id'], record['user_id'], session_day(record)
+    return [
+        (DAILY_TABLE, (guild_id, user_id, day)),
+        (GUILD_DAILY_TABLE, (guild_id, day)),
+        (TOTALS_TABLE, (guild_id, user_id)),
+    ]
+
+
+class StudyRollups:
+    ## per user and per guild daily rollups (minutes, cycles, sessions, quiz scores) plus
+    ## one all-time row per user with streaks, so !stats reads a single row and
+    ## !leaderboard reads at most days x active users rows, however long the history.
+    ## finished sessions are added in memory and written back every `window` seconds.
+    ## a guild lives on exactly one shard process, so that process is the only writer of
+    ## its rows and the cached copies stay authoritative until their ttl runs out
+
+    def __init__(self, db, ttl: float = 300.0, window: float = 5.0, leaderboard_ttl: float = 60.0):
+        self.db = db
+        self.ttl = ttl
+        self.window = window
+        self.leaderboard_ttl = leaderboard_ttl
+
+        self._rows: Dict[Tuple[str, Tuple], Dict[str, Any]] = {}
+        self._expires: Dict[Tuple[str, Tuple], float] = {}
+        self._dirty: Set[Tuple[str, Tuple]] = set()
+        self._pending: List[Dict[str, Any]] = []
+        self._boards: Dict[Tuple[str, int, int], Tuple[float, Any]] = {}
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+        self.flushes = 0
+        self.reads = 0
+
+    def add(self, record: Dict[str, Any]):
+        ## same record that goes to the session log, never waits on the database
+        self._pending.append(record)
+        self._boards = {key: board for key, board in self._boards.items() if key[0] != record['guild_id']}
+        self._schedule()
+
+    def _schedule(self):
+        ## a flush that is still running counts, it looks at what's left once it's done
+        if self._closed:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        await self.flush()
+        ## added while the flush was loading/writing, or a write that failed
+        if self._pending or self._dirty:
+            self._task = None
+            self._schedule()
+
+    async def flush(self):
+        async with self._lock:
+            pending, self._pending = self._pending, []
+            if pending:
+                keys = {key for record in pending for key in rollup_keys(record)}
+                try:
+                    await self._load(keys)
+                except Exception as e:
+                    print(f"Error loading rollups: {e}")
+                    self._pending = pending + self._pending
+                    return
+                for record in pending:
+                    apply_session(self._rows, record)
+                self._dirty.update(keys)
+            await self._write_dirty()
+            self._evict()
+
+    async def _write_dirty(self):
+        dirty, self._dirty = self._dirty, set()
+        by_table = defaultdict(list)
+        for table, key in dirty:
+            by_table[table].append(self._rows[(table, key)])
+
+        for table, rows in by_table.items():
+            try:
+                await self.db.execute(self.db.table(table).upsert(rows, on_conflict=",".join(KEYS[table])))
+                self.flushes += 1
+            except Exception as e:
+                print(f"Error writing rollups to {table}: {e}")
+                ## kept in memory and dirty, the next flush tries again
+                self._dirty.update((table, tuple(row[column] for column in KEYS[table])) for row in rows)
+
+    async def _load(self, keys: Iterable[Tuple[str, Tuple]]):
+        now = time.monotonic()
+        missing = defaultdict(list)
+        for table, key in keys:
+            if (table, key) in self._rows and ((table, key) in self._dirty or self._expires[(table, key)] > now):
+                self._expires[(table, key)] = now + self.ttl
+                continue
+            missing[table].append(key)
+
+        for table, table_keys in missing.items():
+            columns = KEYS[table]
+            query = self.db.table(table).select('*')
+            for index, column in enumerate(columns):
+                query = query.in_(column, sorted({key[index] for key in table_keys}))
+            response = await self.db.execute(query)
+            found = {tuple(str(row[column]) for column in columns): row for row in response.data or []}
+            for key in table_keys:
+                self._rows[(table, key)] = found.get(key) or _empty_row(table, key)
+                self._expires[(table, key)] = now + self.ttl
+
+    def _evict(self):
+        now = time.monotonic()
+        for cache_key in [cache_key for cache_key, expires in self._expires.items() if expires <= now]:
+            if cache_key not in self._dirty:
+                self._rows.pop(cache_key, None)
+                self._expires.pop(cache_key, None)
+
+    async def user_stats(self, guild_id: int, user_id: int) -> Dict[str, Any]:
+        await self.flush()
+        key = (TOTALS_TABLE, (str(guild_id), str(user_id)))
+        self.reads += 1
+        await self._load([key])
+        totals = dict(self._rows[key])
+
+        ## a streak is only current if the last study day was today or yesterday
+        today = datetime.utcnow().date()
+        if totals['last_day'] and totals['last_day'] < (today - timedelta(days=1)).isoformat():
+            totals['current_streak'] = 0
+        totals['avg_quiz'] = totals['quiz_sum'] / totals['quiz_count'] if totals['quiz_count'] else None
+        return totals
+
+    async def leaderboard(self, guild_id: int, days: int = 7, limit: int = 10) -> Dict[str, Any]:
+        board_key = (str(guild_id), days, limit)
+        cached = self._boards.get(board_key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        await self.flush()
+        self.reads += 1
+        since = (datetime.utcnow().date() - timedelta(days=days - 1)).isoformat()
+        users = await self.db.execute(
+            self.db.table(DAILY_TABLE).select('user_id,minutes,cycles,quiz_sum,quiz_count')
+            .eq('guild_id', str(guild_id)).gte('day', since)
+        )
+        guild = await self.db.execute(
+            self.db.table(GUILD_DAILY_TABLE).select('minutes,cycles,sessions').eq('guild_id', str(guild_id)).gte('day', since)
+        )
+
+        per_user = defaultdict(lambda: dict.fromkeys(COUNTERS[:2] + COUNTERS[3:], 0))
+        for row in users.data or []:
+            for counter in per_user[row['user_id']]:
+                per_user[row['user_id']][counter] += row[counter]
+        ranking = sorted(per_user.items(), key=lambda item: item[1]['minutes'], reverse=True)[:limit]
+
+        board = {
+            'days': days,
+            'ranking': [
+                {
+                    'user_id': int(user_id),
+                    'minutes': row['minutes'],
+                    'cycles': row['cycles'],
+                    'avg_quiz': row['quiz_sum'] / row['quiz_count'] if row['quiz_count'] else None,
+                }
+                for user_id, row in ranking
+            ],
+            'guild_minutes': sum(row['minutes'] for row in guild.data or []),
+            'guild_sessions': sum(row['sessions'] for row in guild.data or []),
+        }
+        self._boards[board_key] = (time.monotonic() + self.leaderboard_ttl, board)
+        return board
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'rows_cached': len(self._rows),
+            'dirty': len(self._dirty),
+            'pending': len(self._pending),
+            'flushes': self.flushes,
+            'reads': self.reads,
+        }
+
+    async def close(self):
+        self._closed = True
+        if self._task and not self._task.done():
+            self._task.cancel()
+        self._task = None
+        await self.flush()
+
+
+async def backfill(db, table: str = 'study_sessions', page_size: int = 1000):
+    ## rebuilds every rollup row from the raw session log, absolute values, so running
+    ## it twice gives the same result. run it with the bot stopped
+    rows: Dict[Tuple[str, Tuple], Dict[str, Any]] = {}
+    start = 0
+    while True:
+        response = await db.execute(
+            db.table(table).select('user_id,guild_id,cycles_completed,avg_quiz_score,duration_minutes,started_at,ended_at')
+            .order('ended_at').range(start, start + page_size - 1)
+        )
+        records = response.data or []
+        for record in records:
+            ## rows from before sessions were logged per guild can't be placed
+            if not record.get('guild_id') or not (record.get('ended_at') or record.get('started_at')):
+                continue
+            for key in rollup_keys(record):
+                if key not in rows:
+                    rows[key] = _empty_row(*key)
+            apply_session(rows, record)
+        start += len(records)
+        print(f"backfill: {start} sessions read")
+        if len(records) < page_size:
+            break
+
+    by_table = defaultdict(list)
+    for (table_name, _), row in rows.items():
+        by_table[table_name].append(row)
+    for table_name, table_rows in by_table.items():
+        for offset in range(0, len(table_rows), page_size):
+            batch = table_rows[offset:offset + page_size]
+            await db.execute(db.table(table_name).upsert(batch, on_conflict=",".join(KEYS[table_name])))
+        print(f"backfill: {len(table_rows)} rows written to {table_name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="rebuild the study rollups from study_sessions")
+    parser.add_argument("--page-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    from async_db import AsyncDB
+
+    async def run():
+        db = AsyncDB(timeout=60.0)
+        try:
+            await backfill(db, page_size=args.page_size)
+        finally:
+            db.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import asyncio
+import heapq
+import itertools
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class TimerScheduler:
+    ## one heap of (deadline, token, session_id, phase) for every session and one
+    ## dispatcher task draining it. a session has at most one pending event, a newer
+    ## schedule() or a cancel() just orphans the old heap entry (checked by token)
+    ## instead of searching the heap for it
+
+    def __init__(self, handler: Callable[[Hashable, str], Awaitable[Any]], jitter_samples: int = 10000):
+        self.handler = handler
+        self._heap: List[Tuple[float, int, Hashable, str]] = []
+        self._pending: Dict[Hashable, Tuple[float, int, str]] = {}
+        self._tokens = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._running = set()  ## handler tasks, only alive while a phase transition runs
+
+        self.fired = 0
+        self.lateness = deque(maxlen=jitter_samples)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def schedule(self, session_id: Hashable, delay: float, phase: str):
+        loop = asyncio.get_running_loop()
+        self._ensure_dispatcher(loop)
+
+        deadline = loop.time() + max(0.0, delay)
+        token = next(self._tokens)
+        self._pending[session_id] = (deadline, token, phase)
+        heapq.heappush(self._heap, (deadline, token, session_id, phase))
+
+        if self._heap[0][1] == token:
+            self._arm(loop)
+
+        ## orphaned entries pile up when sessions are re-scheduled or cancelled a lot
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._pending):
+            self._compact()
+
+    def cancel(self, session_id: Hashable):
+        self._pending.pop(session_id, None)
+
+    def pending(self, session_id: Hashable) -> Optional[Tuple[str, float]]:
+        ## (phase, seconds left) for the session's next event
+        entry = self._pending.get(session_id)
+        if entry is None:
+            return None
+        deadline, _, phase = entry
+        return phase, max(0.0, deadline - asyncio.get_running_loop().time())
+
+    def _compact(self):
+        self._heap = [item for item in self._heap if self._is_live(item)]
+        heapq.heapify(self._heap)
+
+    def _is_live(self, item) -> bool:
+        entry = self._pending.get(item[2])
+        return entry is not None and entry[1] == item[1]
+
+    def _arm(self, loop):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if self._heap:
+            self._timer = loop.call_at(self._heap[0][0], self._wakeup.set)
+
+    def _ensure_dispatcher(self, loop):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = loop.create_task(self._dispatch())
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            now = loop.time()
+            while self._heap and self._heap[0][0] <= now:
+                item = heapq.heappop(self._heap)
+                if not self._is_live(item):
+                    continue
+
+                deadline, _, session_id, phase = item
+                del self._pending[session_id]
+                self.fired += 1
+                self.lateness.append(now - deadline)
+
+                task = loop.create_task(self._run(session_id, phase))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+            self._arm(loop)
+
+    async def _run(self, session_id: Hashable, phase: str):
+        try:
+            await self.handler(session_id, phase)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Error handling {phase} for session {session_id}: {e}")
+
+    def jitter(self) -> Dict[str, float]:
+        if not self.lateness:
+            return {'p50': 0.0, 'p99': 0.0, 'max': 0.0}
+        samples = sorted(self.lateness)
+        return {
+            'p50': samples[len(samples) // 2],
+            'p99': samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+            'max': samples[-1],
+        }
+
+    def stop(self):
+        if self._timer:
+            self._timer.cancel()
+        if self._dispatcher:
+            self._dispatcher.cancel()
+        for task in list(self._running):
+            task.cancel()
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import os
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+
+class SessionLogWriter:
+    ## write-behind for finished sessions: enqueue() never waits on the database.
+    ## a background flusher bulk upserts once `batch_size` records are waiting or the
+    ## oldest one is `max_age` seconds old. rows carry an idempotency_key so a retried
+    ## batch can't double count. anything that can't be written (db down, queue full,
+    ## shutdown) goes to a jsonl spill file that is replayed on the next start
+
+    def __init__(self, db, table: str = 'study_sessions', batch_size: int = 50, max_age: float = 10.0,
+                 max_queue: int = 5000, spill_path: Optional[str] = None):
+        self.db = db
+        self.table = table
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.max_queue = max_queue
+        self.spill_path = spill_path or os.getenv("STUDYBUDDY_SPILL_PATH", "session_logs.spill.jsonl")
+
+        self._buffer: deque = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._has_spill = os.path.exists(self.spill_path)
+
+        self.written = 0
+        self.spilled = 0
+        self.batches = 0
+
+    def enqueue(self, record: Dict[str, Any]):
+        if len(self._buffer) >= self.max_queue:
+            self._spill([record])
+            return
+
+        self._buffer.append(record)
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def start(self):
+        for record in await asyncio.to_thread(self._take_spill):
+            self.enqueue(record)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.max_age)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                await self.flush()
+        except asyncio.CancelledError:
+            pass
+
+    async def flush(self):
+        async with self._flush_lock:
+            while self._buffer:
+                batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                try:
+                    await self.db.execute(
+                        self.db.table(self.table).upsert(batch, on_conflict='idempotency_key', ignore_duplicates=True)
+                    )
+                    self.written += len(batch)
+                    self.batches += 1
+                except Exception as e:
+                    print(f"Error writing study session logs, spilling {len(batch)} to disk: {e}")
+                    await asyncio.to_thread(self._spill, batch)
+                    return
+
+            ## the db took everything, so retry whatever was spilled during an outage
+            if self._has_spill and self._task is not None:
+                for record in await asyncio.to_thread(self._take_spill):
+                    self.enqueue(record)
+                if self._buffer:
+                    self._wakeup.set()
+
+    def _spill(self, records: List[Dict[str, Any]]):
+        with open(self.spill_path, 'a', encoding='utf-8') as spill:
+            for record in records:
+                spill.write(json.dumps(record, separators=(',', ':')) + "\n")
+        self.spilled += len(records)
+        self._has_spill = True
+
+    def _take_spill(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.spill_path):
+            return []
+
+        records = []
+        with open(self.spill_path, encoding='utf-8') as spill:
+            for line in spill:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+        os.remove(self.spill_path)
+        self._has_spill = False
+        return records
+
+    async def close(self):
+        ## drain on shutdown, whatever doesn't make it is spilled for next time
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        if self._buffer:
+            remaining = list(self._buffer)
+            self._buffer.clear()
+            await asyncio.to_thread(self._spill, remaining)
@@ -0,0 +1,219 @@
+import argparse
+import asyncio
+import multiprocessing
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class SharedStateBackend:
+    ## state that has to be the same for every shard process: per-user session
+    ## locks and per-user rate limit buckets. swap in something networked (redis,
+    ## supabase) when processes run on more than one host
+
+    async def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        raise NotImplementedError
+
+    async def release(self, key: str, owner: str):
+        raise NotImplementedError
+
+    async def release_owner(self, owner: str) -> int:
+        ## drops every lock `owner` holds, for a restarted process whose old sessions are gone
+        raise NotImplementedError
+
+    async def take_tokens(self, key: str, cost: float, capacity: float, rate: float, dry_run: bool = False) -> float:
+        ## token bucket for `key` (full at `capacity`, refilled at `rate`/s): takes `cost`
+        ## and returns 0 if it's there, otherwise returns the seconds until it would be
+        ## (inf if `cost` is above `capacity`) and takes nothing. dry_run only checks
+        raise NotImplementedError
+
+
+def _refill(tokens: float, updated_at: float, capacity: float, rate: float, now: float) -> float:
+    return min(capacity, tokens + (now - updated_at) * rate)
+
+
+class MemoryStateBackend(SharedStateBackend):
+    ## single process (and tests), same semantics as the sqlite one
+
+    def __init__(self):
+        self._locks: Dict[str, Tuple[str, float]] = {}
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}  ## key -> (tokens, updated_at, full_at)
+
+    async def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        current = self._locks.get(key)
+        if current and current[1] > now and current[0] != owner:
+            return False
+        self._locks[key] = (owner, now + ttl)
+        return True
+
+    async def release(self, key: str, owner: str):
+        current = self._locks.get(key)
+        if current and current[0] == owner:
+            del self._locks[key]
+
+    async def release_owner(self, owner: str) -> int:
+        keys = [key for key, (holder, _) in self._locks.items() if holder == owner]
+        for key in keys:
+            del self._locks[key]
+        return len(keys)
+
+    async def take_tokens(self, key: str, cost: float, capacity: float, rate: float, dry_run: bool = False) -> float:
+        if cost > capacity:
+            return math.inf
+        now = time.time()
+        entry = self._buckets.get(key)
+        tokens = capacity if entry is None else _refill(entry[0], entry[1], capacity, rate, now)
+        if tokens < cost:
+            return (cost - tokens) / rate
+        if not dry_run:
+            tokens -= cost
+            self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            ## a full bucket is the same as none, drop those now and then
+            if len(self._buckets) % 1000 == 0:
+                self._buckets = {key: entry for key, entry in self._buckets.items() if entry[2] > now}
+        return 0.0
+
+
+class SQLiteStateBackend(SharedStateBackend):
+    ## every shard process on one host opens the same file, sqlite's locking does the rest
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("STUDYBUDDY_SHARED_STATE", "shared_state.sqlite3")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS locks (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, full_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS buckets_full_at ON buckets (full_at)")
+
+    def _acquire(self, key: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM locks WHERE key = ? AND (expires_at <= ? OR owner = ?)", (key, now, owner))
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO locks (key, owner, expires_at) VALUES (?, ?, ?)", (key, owner, now + ttl)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return cursor.rowcount == 1
+
+    def _release(self, key: str, owner: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM locks WHERE key = ? AND owner = ?", (key, owner))
+
+    def _release_owner(self, owner: str) -> int:
+        with self._lock:
+            return self._conn.execute("DELETE FROM locks WHERE owner = ?", (owner,)).rowcount
+
+    def _take_tokens(self, key: str, cost: float, capacity: float, rate: float, dry_run: bool) -> float:
+        if cost > capacity:
+            return math.inf
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens = capacity if row is None else _refill(row[0], row[1], capacity, rate, now)
+                wait = max(0.0, (cost - tokens) / rate)
+                if not wait and not dry_run:
+                    tokens -= cost
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO buckets (key, tokens, updated_at, full_at) VALUES (?, ?, ?, ?)",
+                        (key, tokens, now, now + (capacity - tokens) / rate)
+                    )
+                    self._conn.execute("DELETE FROM buckets WHERE full_at <= ?", (now,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return wait
+
+    async def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        return await asyncio.to_thread(self._acquire, key, owner, ttl)
+
+    async def release(self, key: str, owner: str):
+        await asyncio.to_thread(self._release, key, owner)
+
+    async def release_owner(self, owner: str) -> int:
+        return await asyncio.to_thread(self._release_owner, owner)
+
+    async def take_tokens(self, key: str, cost: float, capacity: float, rate: float, dry_run: bool = False) -> float:
+        return await asyncio.to_thread(self._take_tokens, key, cost, capacity, rate, dry_run)
+
+
+def shard_plan(shard_count: int, processes: int) -> List[List[int]]:
+    ## round robin so every process gets a similar mix of big and small shards
+    return [list(range(worker, shard_count, processes)) for worker in range(processes) if worker < shard_count]
+
+
+def _run_worker(token: str, shard_ids: List[int], shard_count: int, state_path: str):
+    ## imported here so the coordinator process never loads discord/gemini/supabase
+    from StudyBuddy import StudyBuddy
+
+    bot = StudyBuddy(shard_ids=shard_ids, shard_count=shard_count, state_backend=SQLiteStateBackend(state_path))
+    bot.run(token)
+
+
+def run_cluster(token: str, processes: int, shard_count: int, state_path: str, restart_delay: float = 5.0):
+    ## the coordinator: one worker process per shard group, restarted if it dies
+    context = multiprocessing.get_context("spawn")
+    plan = shard_plan(shard_count, processes)
+    workers: Dict[int, multiprocessing.Process] = {}
+
+    def spawn(index: int):
+        process = context.Process(
+            target=_run_worker, args=(token, plan[index], shard_count, state_path),
+            name=f"studybuddy-shards-{index}", daemon=False
+        )
+        process.start()
+        workers[index] = process
+        print(f"Started worker {index} (pid {process.pid}) for shards {plan[index]}")
+
+    for index in range(len(plan)):
+        spawn(index)
+
+    try:
+        while True:
+            time.sleep(restart_delay)
+            for index, process in list(workers.items()):
+                if not process.is_alive():
+                    print(f"Worker {index} exited with {process.exitcode}, restarting")
+                    spawn(index)
+    except KeyboardInterrupt:
+        for process in workers.values():
+            process.terminate()
+        for process in workers.values():
+            process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run StudyBuddy, optionally sharded across processes")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--shards", type=int, default=None, help="total shard count (default: 2 per process)")
+    parser.add_argument("--state", default=os.getenv("STUDYBUDDY_SHARED_STATE", "shared_state.sqlite3"))
+    args = parser.parse_args()
+
+    token = os.getenv("BOT_TOKEN")
+    if not token:
+        raise ValueError("Missing required environment variable BOT_TOKEN")
+
+    if args.processes <= 1:
+        ## one process, discord.py auto-shards inside it
+        from StudyBuddy import StudyBuddy
+        StudyBuddy(state_backend=MemoryStateBackend()).run(token)
+    else:
+        run_cluster(token, args.processes, args.shards or args.processes * 2, args.state)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+import asyncio
+import heapq
+import itertools
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+import discord
+
+from metrics import metrics
+
+## lower goes first
+PRIORITY_QUIZ = 0
+PRIORITY_STATUS = 1
+PRIORITY_COSMETIC = 2
+
+
+class OutboundQueue:
+    ## every message the bot sends/edits for sessions goes through here.
+    ## quiz interactions jump ahead of panel edits, jobs submitted with the same
+    ## key collapse into the newest one. discord rate limits per channel, so a 429
+    ## only parks that channel's jobs for retry_after, every other channel keeps going
+
+    def __init__(self, workers: int = 4, max_retries: int = 3):
+        self.workers = workers
+        self.max_retries = max_retries
+        self._heap: List[list] = []
+        self._keyed: Dict[Hashable, list] = {}
+        self._seq = itertools.count()
+        self._ready = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._paused: Dict[Hashable, asyncio.TimerHandle] = {}  ## channel -> when its jobs go back in the heap
+        self._parked: Dict[Hashable, List[list]] = {}
+
+        self.sent = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+
+    def submit(self, factory: Callable[[], Awaitable[Any]], priority: int = PRIORITY_STATUS,
+               key: Optional[Hashable] = None, channel: Optional[Hashable] = None) -> asyncio.Future:
+        ## `channel` is the id the job sends to or edits in, jobs without one share a route
+        loop = asyncio.get_running_loop()
+        self._ensure_workers(loop)
+
+        if key is not None and key in self._keyed:
+            ## still queued, the newer content wins and nobody pays for the old one
+            entry = self._keyed[key]
+            entry[3] = factory
+            self.coalesced += 1
+            return entry[4]
+
+        entry = [priority, next(self._seq), key, factory, loop.create_future(), channel, 0]
+        heapq.heappush(self._heap, entry)
+        if key is not None:
+            self._keyed[key] = entry
+        self._ready.set()
+        return entry[4]
+
+    def _ensure_workers(self, loop):
+        self._tasks = [task for task in self._tasks if not task.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(loop.create_task(self._work()))
+
+    def _park(self, entry: list):
+        ## still under its key, a newer submit replaces the content of a parked job too
+        self._parked.setdefault(entry[5], []).append(entry)
+
+    def _pause(self, channel: Optional[Hashable], retry_after: float):
+        loop = asyncio.get_running_loop()
+        current = self._paused.get(channel)
+        if current is not None:
+            if current.when() >= loop.time() + retry_after:
+                return
+            current.cancel()
+        self._paused[channel] = loop.call_later(retry_after, self._resume, channel)
+
+    def _resume(self, channel: Optional[Hashable]):
+        ## back in seq order, so the channel's jobs still go out in the order they came in
+        self._paused.pop(channel, None)
+        for entry in self._parked.pop(channel, []):
+            heapq.heappush(self._heap, entry)
+        self._ready.set()
+
+    async def _work(self):
+        while True:
+            while not self._heap:
+                self._ready.clear()
+                await self._ready.wait()
+
+            entry = heapq.heappop(self._heap)
+            _, _, key, factory, future, channel, attempts = entry
+            if channel in self._paused:
+                self._park(entry)
+                continue
+            if key is not None and self._keyed.get(key) is entry:
+                del self._keyed[key]
+
+            try:
+                with metrics.span("discord.send"):
+                    result = await factory()
+                self.sent += 1
+                if not future.done():
+                    future.set_result(result)
+            except discord.HTTPException as e:
+                if e.status == 429 and attempts < self.max_retries:
+                    self.rate_limited += 1
+                    entry[6] += 1
+                    self._pause(channel, getattr(e, 'retry_after', None) or 1.0)
+                    self._park(entry)
+                elif not future.done():
+                    future.set_exception(e)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        for handle in self._paused.values():
+            handle.cancel()
+        self._paused.clear()
+
+
+@lru_cache(maxsize=512)
+def render_progress_bar(completed: int, target: int, phase: str) -> str:
+    remaining = target - completed
+    if phase == "work_start":
+        return "🟢" * completed + "🔴" + "⚪" * max(0, remaining - 1)
+    return "🟢" * completed + "⚪" * max(0, remaining)
+
+
+@lru_cache(maxsize=512)
+def render_status(completed: int, target: int, phase: str) -> str:
+    if phase == "work_start":
+        return f"🎯 **Cycle {completed}/{target}** - Work Session Active"
+    if phase == "break_start":
+        return f"✅ **Cycle {completed}/{target}** Complete - Break Time"
+    return f"📊 Progress: {completed}/{target}"
+
+
+class ThrottledEdit:
+    ## keeps an already sent message in sync with render(), at most one edit every
+    ## `interval` seconds: the first change goes out right away, anything after that
+    ## is folded into the next slot, and render() runs when the edit is actually sent
+
+    def __init__(self, message, queue: OutboundQueue, render: Callable[[], discord.Embed], interval: float = 1.0):
+        self.message = message
+        self.queue = queue
+        self.render = render
+        self.interval = interval
+        self._last = float('-inf')
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def touch(self):
+        if self._timer is not None:
+            return
+        loop = asyncio.get_running_loop()
+        wait = self._last + self.interval - loop.time()
+        if wait <= 0:
+            self._submit()
+        else:
+            self._timer = loop.call_later(wait, self._submit)
+
+    def flush(self):
+        if self._timer:
+            self._timer.cancel()
+        self._submit()
+
+    def _submit(self):
+        self._timer = None
+        self._last = asyncio.get_running_loop().time()
+        future = self.queue.submit(lambda: self.message.edit(embed=self.render()), PRIORITY_STATUS, key=('edit', id(self)),
+                                   channel=self.message.channel.id)
+        future.add_done_callback(self._log_failure)
+
+    def _log_failure(self, future: asyncio.Future):
+        if not future.cancelled() and future.exception():
+            print(f"Error editing message: {future.exception()}")
+
+
+class StatusPanel:
+    ## one progress message per session, edited in place. update() only records
+    ## the state, the edit goes out after `debounce` seconds so a burst of updates
+    ## (quiz score + break start + note) costs a single api call
+
+    def __init__(self, context, queue: OutboundQueue, debounce: float = 1.5):
+        self.context = context
+        self.queue = queue
+        self.debounce = debounce
+        self.message = None
+        self.state: Dict[str, Any] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._lock = asyncio.Lock()
+        self.edits = 0
+
+    def update(self, **state):
+        self.state.update(state)
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.debounce, self._submit)
+
+    def flush_now(self):
+        if self._timer:
+            self._timer.cancel()
+        self._submit()
+
+    def _submit(self):
+        self._timer = None
+        future = self.queue.submit(self._flush, PRIORITY_COSMETIC, key=('panel', id(self)), channel=self.context.channel.id)
+        future.add_done_callback(self._log_failure)
+
+    def _log_failure(self, future: asyncio.Future):
+        if not future.cancelled() and future.exception():
+            print(f"Error updating status panel: {future.exception()}")
+
+    def render(self) -> discord.Embed:
+        state = self.state
+        completed = state.get('completed', 0)
+        target = state.get('target', 1)
+        phase = state.get('phase', 'progress')
+
+        embed = discord.Embed(
+            title="📈 Study Progress",
+            description=render_status(completed, target, phase),
+            color=0x3498db if phase == "break_start" else 0xe67e22
+        )
+        embed.add_field(name="Progress Bar", value=render_progress_bar(completed, target, phase), inline=False)
+
+        if state.get('remaining_minutes'):
+            embed.add_field(name="⏱️ Estimated Remaining", value=f"~{state['remaining_minutes']} minutes", inline=True)
+        if state.get('quiz_average') is not None:
+            embed.add_field(name="🧠 Quiz Average", value=f"{state['quiz_average']:.0f}%", inline=True)
+        if state.get('note'):
+            embed.add_field(name="📣 Latest", value=state['note'], inline=False)
+        return embed
+
+    async def _flush(self):
+        async with self._lock:
+            embed = self.render()
+            if self.message is None:
+                self.message = await self.context.send(embed=embed)
+            else:
+                await self.message.edit(embed=embed)
+                self.edits += 1
+
+    def close(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
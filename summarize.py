@@ -0,0 +1,177 @@
+import asyncio
+import re
+import zlib
+from typing import List, Optional
+
+CHUNK_PROMPT_VERSION = 1
+CHUNK_TOKEN_BUDGET = 3000
+
+_HEADING = re.compile(r'^\s*(#{1,6}\s+\S|(\d+(\.\d+)*)\s+[A-Z]|[A-Z][A-Z0-9 ,:&-]{3,}$|(chapter|section|lecture|unit)\s+\d+)', re.IGNORECASE)
+
+
+def estimate_tokens(text: str) -> int:
+    ## ~4 characters per token is close enough for budgeting
+    return max(1, len(text) // 4)
+
+
+def split_sections(document: str) -> List[str]:
+    ## paragraphs, with headings always starting a new section
+    sections = []
+    current = []
+
+    for paragraph in re.split(r'\n\s*\n', document):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and _HEADING.match(paragraph.split('\n', 1)[0]):
+            sections.append("\n\n".join(current))
+            current = []
+        current.append(paragraph)
+
+    if current:
+        sections.append("\n\n".join(current))
+    return sections
+
+
+def _split_oversized(section: str, budget: int) -> List[str]:
+    max_chars = budget * 4
+    pieces = []
+    current = ""
+    for sentence in re.split(r'(?<=[.!?])\s+', section):
+        while len(sentence) > max_chars:
+            pieces.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if current and len(current) + len(sentence) + 1 > max_chars:
+            pieces.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_into_chunks(documents: List[str], token_budget: int = CHUNK_TOKEN_BUDGET) -> List[str]:
+    ## chunks never cross a document boundary. inside a document, sections are packed
+    ## up to the budget, and a chunk also ends after any section whose hash hits a
+    ## fixed pattern. that makes boundaries depend on content, not on position, so an
+    ## edit early in a document doesn't shift every later chunk (and miss the cache)
+    chunks = []
+
+    for document in documents:
+        current = []
+        current_tokens = 0
+
+        for section in split_sections(document):
+            tokens = estimate_tokens(section)
+            parts = [section] if tokens <= token_budget else _split_oversized(section, token_budget)
+
+            for part in parts:
+                part_tokens = estimate_tokens(part)
+                if current and current_tokens + part_tokens > token_budget:
+                    chunks.append("\n\n".join(current))
+                    current = []
+                    current_tokens = 0
+
+                current.append(part)
+                current_tokens += part_tokens
+
+                if current_tokens >= token_budget // 4 and zlib.crc32(part.encode('utf-8')) % 4 == 0:
+                    chunks.append("\n\n".join(current))
+                    current = []
+                    current_tokens = 0
+
+        if current:
+            chunks.append("\n\n".join(current))
+
+    return chunks
+
+
+class Condensed:
+    def __init__(self, text: str, chunks_total: int = 0, chunks_failed: int = 0):
+        self.text = text
+        self.chunks_total = chunks_total
+        self.chunks_failed = chunks_failed  ## chunks left out because their summary failed
+
+    @property
+    def partial(self) -> bool:
+        return self.chunks_failed > 0
+
+    @property
+    def failed(self) -> bool:
+        ## every summary failed, there's nothing left to analyze
+        return not self.text.strip()
+
+    def describe(self) -> str:
+        return f"{self.chunks_total - self.chunks_failed}/{self.chunks_total} parts summarized"
+
+
+class ChunkSummarizer:
+    ## map step of the analysis: every chunk gets its own short summary, cached per
+    ## chunk. only as many chunks run at once as the guild has gateway slots, a chunk's
+    ## deadline starts when it gets a slot, not while it queues behind the others
+
+    def __init__(self, gateway, cache):
+        self.gateway = gateway
+        self.cache = cache
+
+    def _prompt(self, chunk: str) -> str:
+        return f"""
+            You are summarizing one part of a larger piece of study material.
+
+            **Task:** Summarize the key concepts, definitions and facts in the text below as a short list of bullet points. Keep every point that a student would need for an exam, drop examples and filler.
+
+            **Source Text:**
+            ---
+            {chunk}
+            ---
+
+            **Instructions for Output Format:**
+            - Respond ONLY with bullet points, each starting with a hyphen and a space (`- `).
+            """
+
+    async def summarize_chunk(self, chunk: str, guild_id: Optional[int] = None) -> Optional[str]:
+        ## None when the summary failed, the caller reports it instead of using raw text
+        cached = await self.cache.get('chunk', chunk, CHUNK_PROMPT_VERSION)
+        if cached is not None:
+            return cached
+
+        try:
+            response_text = await self.gateway.generate(self._prompt(chunk), guild_id=guild_id)
+        except Exception as e:
+            print(f"Error summarizing chunk: {e}")
+            ## not cached, the next upload gets another try
+            return None
+
+        points = [line.strip() for line in response_text.split('\n') if line.strip().startswith('-')]
+        summary = "\n".join(points) or response_text.strip()
+        await self.cache.put('chunk', chunk, CHUNK_PROMPT_VERSION, summary)
+        return summary
+
+    async def summarize_chunks(self, chunks: List[str], guild_id: Optional[int] = None) -> List[Optional[str]]:
+        ## more in flight than the guild has slots would only sit in the gateway's queue
+        limit = asyncio.Semaphore(self.gateway.per_guild_concurrency if guild_id is not None else len(chunks) or 1)
+
+        async def summarize(chunk: str) -> Optional[str]:
+            async with limit:
+                return await self.summarize_chunk(chunk, guild_id)
+
+        return list(await asyncio.gather(*[summarize(chunk) for chunk in chunks]))
+
+    async def condense(self, documents: List[str], guild_id: Optional[int] = None,
+                       token_budget: int = CHUNK_TOKEN_BUDGET, max_rounds: int = 3) -> Condensed:
+        ## map chunk summaries, then re-chunk the summaries until they fit in one prompt
+        if sum(estimate_tokens(document) for document in documents) <= token_budget:
+            return Condensed("\n\n".join(documents))
+
+        chunks = split_into_chunks(documents, token_budget)
+        total = len(chunks)
+        failed = 0
+
+        for _ in range(max_rounds):
+            if len(chunks) <= 1:
+                break
+            summaries = await self.summarize_chunks(chunks, guild_id)
+            failed += sum(1 for summary in summaries if summary is None)
+            chunks = split_into_chunks(["\n\n".join(summary for summary in summaries if summary is not None)], token_budget)
+
+        return Condensed("\n\n".join(chunks), total, failed)
@@ -0,0 +1,149 @@
+import hashlib
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List
+
+from summarize import estimate_tokens
+
+## pdf_extract separates pages with a form feed, plain text files are one page
+PAGE_BREAK = "\f"
+
+_INVISIBLE = dict.fromkeys(map(ord, "\u00ad\u200b\u200c\u200d\u2060\ufeff"), None)
+_CONTROL = re.compile(r"[\x00-\x08\x0b\x0e-\x1f\x7f]")
+_CID = re.compile(r"\(cid:\d+\)")
+_SPACES = re.compile(r"[ \t]+")
+_PAGE_NUMBER = re.compile(r"^(page\s*)?[-–]?\s*\d{1,4}\s*[-–]?(\s*(of|/)\s*\d{1,4})?$", re.IGNORECASE)
+_DIGITS = re.compile(r"\d+")
+_SENTENCE_END = (".", "!", "?", ":", ";")
+
+
+def _canonical(line: str) -> str:
+    ## "Lecture 3 - Page 12" and "Lecture 3 - Page 13" are the same footer
+    return _DIGITS.sub("#", line.lower())
+
+
+class TextNormalizer:
+    ## cleans extracted text page by page before it reaches a prompt:
+    ## - lines repeated at the top/bottom of many pages (headers, footers, page numbers)
+    ## - words hyphenated across lines and hard line wraps inside paragraphs
+    ## - paragraphs seen before (same slide twice, same file uploaded twice)
+    ## - invisible characters, control bytes and (cid:NN) decoding leftovers
+    ## repeated lines are learned from the first `lookahead` pages and keep being counted
+    ## as pages stream through, so only that many pages are ever held back.
+    ## one normalizer per session, duplicate paragraphs are found across all its documents
+
+    def __init__(self, lookahead: int = 8, edge_lines: int = 3, min_repeats: int = 3, repeat_ratio: float = 0.5):
+        self.lookahead = lookahead
+        self.edge_lines = edge_lines
+        self.min_repeats = min_repeats
+        self.repeat_ratio = repeat_ratio
+
+        self._edge_counts: Counter = Counter()
+        self._pages_seen = 0
+        self._paragraphs = set()
+
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.lines_dropped = 0
+        self.paragraphs_dropped = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.tokens_in - self.tokens_out)
+
+    def normalize(self, text: str) -> str:
+        return "\n\n".join(self.pages(text.split(PAGE_BREAK)))
+
+    def normalize_documents(self, documents: List[str]) -> List[str]:
+        cleaned = [self.normalize(document) for document in documents]
+        return [document for document in cleaned if document.strip()]
+
+    def pages(self, pages: Iterable[str]) -> Iterator[str]:
+        held = []
+        for page in pages:
+            self.tokens_in += estimate_tokens(page) if page.strip() else 0
+            lines = self._lines(page)
+            self._count_edges(lines)
+            held.append(lines)
+            if len(held) >= self.lookahead:
+                yield from self._emit(held.pop(0))
+        for lines in held:
+            yield from self._emit(lines)
+
+    def _lines(self, page: str) -> List[str]:
+        page = unicodedata.normalize("NFKC", page).translate(_INVISIBLE)
+        page = _CID.sub("", _CONTROL.sub("", page))
+        return [_SPACES.sub(" ", line).strip() for line in page.splitlines()]
+
+    def _edges(self, lines: List[str]) -> List[str]:
+        content = [line for line in lines if line]
+        if len(content) <= 2 * self.edge_lines:
+            return content
+        return content[:self.edge_lines] + content[-self.edge_lines:]
+
+    def _count_edges(self, lines: List[str]):
+        self._pages_seen += 1
+        self._edge_counts.update({_canonical(line) for line in self._edges(lines)})
+
+    def _is_boilerplate(self, line: str) -> bool:
+        if _PAGE_NUMBER.match(line):
+            return True
+        if self._pages_seen < self.min_repeats:
+            return False
+        count = self._edge_counts.get(_canonical(line), 0)
+        return count >= self.min_repeats and count >= self.repeat_ratio * self._pages_seen
+
+    def _emit(self, lines: List[str]) -> Iterator[str]:
+        edges = set(self._edges(lines))
+        kept = []
+        for line in lines:
+            if line and line in edges and self._is_boilerplate(line):
+                self.lines_dropped += 1
+                continue
+            kept.append(line)
+
+        paragraphs = []
+        for paragraph in self._paragraphs_of(kept):
+            key = hashlib.blake2b(paragraph.lower().encode("utf-8"), digest_size=8).digest()
+            ## short lines ("Example:", "Summary") legitimately repeat
+            if len(paragraph) >= 40 and key in self._paragraphs:
+                self.paragraphs_dropped += 1
+                continue
+            self._paragraphs.add(key)
+            paragraphs.append(paragraph)
+
+        text = "\n\n".join(paragraphs)
+        if text:
+            self.tokens_out += estimate_tokens(text)
+            yield text
+
+    def _paragraphs_of(self, lines: List[str]) -> Iterator[str]:
+        ## blank lines end a paragraph. otherwise a line is glued onto the previous one when
+        ## it was hyphenated, or when the previous line doesn't end a sentence and this
+        ## one starts in lowercase (a hard wrap, not a heading or a new bullet)
+        current = ""
+        for line in lines:
+            if not line:
+                if current:
+                    yield current
+                current = ""
+            elif not current:
+                current = line
+            elif current.endswith("-") and len(current) > 1 and current[-2].isalpha() and line[0].islower():
+                current = current[:-1] + line
+            elif not current.endswith(_SENTENCE_END) and line[0].islower():
+                current = f"{current} {line}"
+            else:
+                current = f"{current}\n{line}"
+        if current:
+            yield current
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'tokens_in': self.tokens_in,
+            'tokens_out': self.tokens_out,
+            'tokens_saved': self.tokens_saved,
+            'lines_dropped': self.lines_dropped,
+            'paragraphs_dropped': self.paragraphs_dropped,
+        }
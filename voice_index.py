@@ -0,0 +1,65 @@
+import asyncio
+from typing import Callable, Dict, Optional, Set, Tuple
+
+
+class VoiceIndex:
+    ## who is studying where: (guild_id, study_channel_id) -> user ids, plus the
+    ## reverse map so a voice event can be checked with one dict lookup.
+    ## leaving the channel doesn't cancel right away, the user gets `grace` seconds
+    ## to come back (discord reconnects, switching devices...)
+
+    def __init__(self, grace: float = 15.0):
+        self.grace = grace
+        self._channels: Dict[Tuple[int, int], Set[int]] = {}
+        self._users: Dict[int, Tuple[int, int]] = {}
+        self._leaving: Dict[int, asyncio.TimerHandle] = {}
+
+        self.debounced = 0
+
+    def __len__(self):
+        return len(self._users)
+
+    def watch(self, user_id: int, guild_id: int, channel_id: int):
+        self.unwatch(user_id)
+        key = (guild_id, channel_id)
+        self._users[user_id] = key
+        self._channels.setdefault(key, set()).add(user_id)
+
+    def unwatch(self, user_id: int):
+        self.cancel_leave(user_id)
+        key = self._users.pop(user_id, None)
+        if key is None:
+            return
+        members = self._channels.get(key)
+        if members is not None:
+            members.discard(user_id)
+            if not members:
+                del self._channels[key]
+
+    def channel_of(self, user_id: int) -> Optional[Tuple[int, int]]:
+        return self._users.get(user_id)
+
+    def members(self, guild_id: int, channel_id: int) -> Set[int]:
+        return self._channels.get((guild_id, channel_id), set())
+
+    def schedule_leave(self, user_id: int, callback: Callable[[], None]):
+        if user_id in self._leaving:
+            return
+        loop = asyncio.get_running_loop()
+        self._leaving[user_id] = loop.call_later(self.grace, self._left, user_id, callback)
+
+    def is_leaving(self, user_id: int) -> bool:
+        ## out of the channel but still inside the grace period
+        return user_id in self._leaving
+
+    def cancel_leave(self, user_id: int) -> bool:
+        handle = self._leaving.pop(user_id, None)
+        if handle is None:
+            return False
+        handle.cancel()
+        self.debounced += 1
+        return True
+
+    def _left(self, user_id: int, callback: Callable[[], None]):
+        self._leaving.pop(user_id, None)
+        callback()